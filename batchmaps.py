@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Batch map generation, requires draw_util
+# A batch is a list of map specs. The addresses of all specs are geocoded once up front with one shared cache, the maps
+# are built and rendered in a pool of worker processes, and every map links one bundle of the folium_addons JavaScript/CSS
+# it uses instead of repeating the links in its header; maps using the same assets share their bundle.
+
+import os, sys, json, time, hashlib, argparse
+import multiprocessing as mp
+from draw_util import *
+from htmlopt import save_html, ASSET_DIR, ASSET_LINK
+
+MAP_DEFAULTS = {'location': [1.34, 103.82], 'zoom_start': 11, 'control_scale': True}
+SHOW_FUNCS = {'heatmaps': showHeatmaps, 'countmaps': showCountmaps}
+
+
+def geocodeLayer(layer, cache):
+	# INPUT: one layer of showHeatmaps()/showCountmaps() input
+	# OUTPUT: the layer with every address replaced by its geo-coordinates, <cache> as in geocode()
+	chunked, layer = chunkIter(layer)
+	if chunked:
+		# geocoded one chunk at a time as in foldChunks(), static chunks are summed per location right away
+		return [geocodeChunk(df, cache) for df in layer]
+	if isinstance(layer, pd.DataFrame):
+		return inferLatLon(layer, cache)
+	items = list(layer.items() if type(layer) == dict else layer)
+	geo = np.full((len(items), 2), nan)
+	is_name = np.array([type(addr) in [int, str] for addr, _ in items], dtype=bool)
+	if is_name.any():
+		geo[is_name] = geocode([addr for (addr, _), b in zip(items, is_name) if b], cache)
+	# [latitude, longitude] keys are kept as they are, and addresses not found become NaN, which showCountmaps() drops
+	return [((addr if not b else tuple(g)), cnt) for (addr, cnt), b, g in zip(items, is_name, geo.tolist())]
+
+
+def geocodeChunk(df, cache):
+	# OUTPUT: one chunk of a chunked layer as pd.DataFrame(columns=['latitude', 'longitude', 'count']), time-stamped
+	#         chunks keep their events, others are summed per location
+	df = inferLatLon(df, cache)
+	if isinstance(df.index, pd.DatetimeIndex):
+		return df[['latitude', 'longitude', 'count']]
+	return aggGeoCount(df['latitude'].values, df['longitude'].values, df['count'].values)
+
+
+def bundleAssets(html, bundle_url):
+	# OUTPUT: (html, the folium_addons assets linked in its header in order), with the links replaced by the ones of the
+	#         bundle of exactly these assets, <bundle_url>-<bundleKey(assets)>.js and .css
+	assets = [m.group(1) or m.group(2) for m in ASSET_LINK.finditer(html)]
+	url = '%s-%s' % (bundle_url, bundleKey(assets))
+	links = ''.join(['    <script src="%s.js"></script>\n' % url] * any(fn.endswith('.js') for fn in assets) +
+	                ['    <link rel="stylesheet" href="%s.css"/>\n' % url] * any(fn.endswith('.css') for fn in assets))
+	first = [True]
+	def repl(m):
+		if not first[0]:
+			return ''
+		first[0] = False
+		return links
+	return ASSET_LINK.sub(repl, html), assets
+
+
+def bundleKey(assets):
+	# maps linking the same assets share one bundle, named after them
+	return hashlib.sha1('\n'.join(assets).encode('utf8')).hexdigest()[:10]
+
+
+def writeBundle(assets, bundle_fn):
+	# concatenate the folium_addons assets into <bundle_fn>.js and <bundle_fn>.css, each written only if needed
+	# OUTPUT: the list of files written
+	os.makedirs(os.path.dirname(bundle_fn) or '.', exist_ok=True)
+	written = []
+	for ext, sep in [('.js', '\n;\n'), ('.css', '\n')]:
+		fns = [fn for fn in assets if fn.endswith(ext)]
+		if not fns:
+			continue
+		with open(bundle_fn + ext, 'w') as fp:
+			for fn in fns:
+				fp.write('/* %s */\n' % fn + open(os.path.join(ASSET_DIR, fn)).read().rstrip('\n') + sep)
+		written += [bundle_fn + ext]
+	return written
+
+
+def renderMap(spec, out_fn, bundle_url, optimize=None):
+	# build, render and write one map spec whose layers are already geocoded, optimized by htmlopt.save_html(**optimize)
+	# OUTPUT: (output file, folium_addons assets used, HTML bytes)
+	with stats.timer('batch.build'):
+		map_obj = folium.Map(**{**MAP_DEFAULTS, **spec.get('map', {})})
+		options = dict(spec.get('options', {}))
+		if spec.get('kind', 'heatmaps') == 'heatmaps':
+			options['n_jobs'] = 1
+		SHOW_FUNCS[spec.get('kind', 'heatmaps')](spec['layers'], map_obj, **options)
+		if spec.get('fit_bounds'):
+			map_obj.fit_bounds(map_obj.get_bounds())
+	with stats.timer('batch.render'):
+		html, assets = bundleAssets(map_obj.get_root().render(), bundle_url)
+	os.makedirs(os.path.dirname(out_fn) or '.', exist_ok=True)
+	if optimize is not None:
+		with stats.timer('batch.optimize'):
+			report = save_html(html, out_fn, **optimize)
+		return report['file'], assets, report.get('gzip', report['html'])
+	with open(out_fn, 'w') as fp:
+		fp.write(html)
+	return out_fn, assets, len(html.encode('utf8'))
+
+
+def renderMapWorker(args):
+	# worker of renderBatch()
+	# OUTPUT: (renderMap() output, the worker's stats snapshot)
+	stats.reset()
+	return renderMap(*args), stats.snapshot()
+
+
+def renderBatch(specs, out_dir, n_jobs=None, bundle='assets/folium_addons', optimize=None, stderr=None):
+	# INPUT specs = [{'out': 'file.html', 'kind': 'heatmaps' or 'countmaps', 'layers': obj of showHeatmaps()/showCountmaps(),
+	#                 'options': {keyword arguments of showHeatmaps()/showCountmaps()}, 'map': {folium.Map arguments},
+	#                 'fit_bounds': False}, ...]
+	# the maps are written to out_dir/<out>, and the asset bundles to out_dir/<bundle>-<key>.js and .css
+	# n_jobs: the number of worker processes, defaults to the number of CPUs; 1 => all in this process
+	# optimize: None, or the keyword arguments of htmlopt.save_html() to write size-optimized (and optionally gzipped) maps
+	# OUTPUT: a report of the number of maps, the seconds spent geocoding and rendering, and the maps per second
+	t0 = time.perf_counter()
+	cache = {}
+	with stats.timer('batch.geocode'):
+		specs = [{**spec, 'layers': [(key, geocodeLayer(layer, cache)) for key, layer in
+		                             (spec['layers'].items() if hasattr(spec['layers'], 'items') else spec['layers'])]} for spec in specs]
+	t1 = time.perf_counter()
+
+	bundle_fn = os.path.join(out_dir, bundle)
+	args = []
+	for spec in specs:
+		out_fn = os.path.join(out_dir, spec['out'])
+		args += [(spec, out_fn, os.path.relpath(bundle_fn, os.path.dirname(out_fn)).replace(os.sep, '/'), optimize)]
+	n_jobs = min(n_jobs or os.cpu_count() or 1, len(args))
+	if n_jobs > 1 and not mp.current_process().daemon:
+		# fork shares the loaded address database with the workers, see heatmapLayers()
+		ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+		with ctx.Pool(n_jobs) as pool:
+			results = []
+			for res, worker_stats in pool.imap(renderMapWorker, args):
+				stats.merge(worker_stats)
+				results += [res]
+				if stderr != None:
+					print('%d/%d maps written' % (len(results), len(args)), file=stderr, flush=True)
+	else:
+		results = [renderMap(*a) for a in args]
+
+	# one bundle per distinct list of assets in header order, so that e.g. count-maps do not load the heatmap scripts
+	bundles = {bundleKey(fns): fns for _, fns, _ in results}
+	bundle_fns = [fn for key, fns in bundles.items() for fn in writeBundle(fns, '%s-%s' % (bundle_fn, key))]
+	assets = list(dict.fromkeys(fn for fns in bundles.values() for fn in fns))
+	t2 = time.perf_counter()
+	return {'maps': len(results), 'geocode_s': t1 - t0, 'render_s': t2 - t1, 'total_s': t2 - t0,
+	        'maps_per_s': len(results) / (t2 - t0) if t2 > t0 else 0., 'html_bytes': sum(size for _, _, size in results),
+	        'bundle': bundle_fns, 'assets': assets}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] specs.json out_dir',
+	                                 description='render a batch of maps; specs.json is a list of map specs as in renderBatch(), whose '
+	                                             'layers are CSV file names with columns [datetime,]address or latitude+longitude[,count]',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('specs_file', help='JSON list of map specs')
+	parser.add_argument('out_dir', help='output directory of the maps and the asset bundle')
+	parser.add_argument('--n-jobs', '-j', help='number of worker processes, 0 for one per CPU', type=int, default=0)
+	parser.add_argument('--decimals', '-d', help='optimize the HTML, keeping this many decimals in the floats of the scripts (see htmlopt.py)', type=int, default=None)
+	parser.add_argument('--gzip', '-z', help='optimize the HTML, and write it as .html.gz', dest='compress', action='store_true')
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	def read_layer(fn):
+		df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(specs_file)), fn))
+		return df.set_index(pd.DatetimeIndex(pd.to_datetime(df.pop('datetime')))) if 'datetime' in df.columns else df
+
+	# layer keys are a color, or 'color,name'
+	specs = json.load(open(specs_file))
+	for spec in specs:
+		spec['layers'] = [(tuple(key.split(',', 1)) if ',' in key else key, read_layer(fn)) for key, fn in spec['layers'].items()]
+	optimize = {'decimals': 6 if decimals is None else decimals, 'compress': compress} if decimals is not None or compress else None
+	report = renderBatch(specs, out_dir, n_jobs or None, optimize=optimize, stderr=sys.stderr)
+	print(json.dumps(report, indent=1), file=sys.stderr)
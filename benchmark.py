@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# Offline benchmark suite for address search, geocoding and map rendering
+# A synthetic address database is generated into the work directory, so no download or network access is needed.
+# Results are written as JSON, and can be compared against the results of a previous run with --compare.
+
+import os, sys, gzip, json, time, argparse, resource, platform
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+ROAD_BASES = ['ANG MO KIO', 'BEDOK NORTH', 'BUKIT BATOK', 'BUKIT PANJANG', 'CHOA CHU KANG', 'CLEMENTI', 'DOVER', 'GHIM MOH',
+              'HOUGANG', 'JURONG EAST', 'JURONG WEST', 'KIM TIAN', 'MARINE', 'PASIR RIS', 'PUNGGOL', 'QUEENSTOWN', 'SENGKANG',
+              'SERANGOON', 'TAMPINES', 'TOA PAYOH', 'WOODLANDS', 'YISHUN', 'HOLLAND', 'BISHAN', 'BOON LAY', 'TELOK BLANGAH']
+ROAD_TYPES = ['ROAD', 'AVENUE %d', 'STREET %d', 'CRESCENT', 'DRIVE', 'LINK', 'LANE', 'CENTRAL', 'RISE']
+ABBR = {'ROAD': 'RD', 'AVENUE': 'AVE', 'STREET': 'ST', 'DRIVE': 'DR', 'LINK': 'LK', 'LANE': 'LN'}
+SG_AREA = (1.24, 1.46, 103.62, 104.0)  # lat_min, lat_max, lon_min, lon_max
+
+
+def make_database(n, seed=0):
+	# synthetic address records in the format of database.json.gz produced by process.sh
+	rng = np.random.default_rng(seed)
+	roads = [base + ' ' + (rt % rng.integers(1, 10) if '%' in rt else rt) for base in ROAD_BASES for rt in ROAD_TYPES]
+	road_geo = np.column_stack([rng.uniform(*SG_AREA[:2], len(roads)), rng.uniform(*SG_AREA[2:], len(roads))])
+	postals = rng.choice(np.arange(10000, 830000), n, replace=False)
+	db = []
+	for i in range(n):
+		ri = rng.integers(len(roads))
+		road, blk = roads[ri], str(rng.integers(1, 999)) + ('' if rng.random() < 0.9 else 'A')
+		r = rng.random()
+		building = 'NIL' if r < 0.7 else ('%s VIEW' % road.split()[0] if r < 0.9 else '%s %s' % (road.split()[0], rng.choice(['PLAZA', 'COURT', 'MRT STATION'])))
+		lat, lon = road_geo[ri] + rng.normal(0, 0.003, 2)
+		db += [{'ADDRESS': ' %s %s %sSINGAPORE %06d ' % (blk, road, '' if building == 'NIL' else building + ' ', postals[i]),
+		        'BLK_NO': blk, 'BUILDING': building, 'LATITUDE': round(lat, 6), 'LONGITUDE': round(lon, 6),
+		        'POSTAL': '%06d' % postals[i], 'ROAD_NAME': road,
+		        'X': round((lon - 103.833333) * 111319.49 + 28001.642, 5), 'Y': round((lat - 1.366666) * 110574.27 + 38744.572, 5)}]
+	return db
+
+
+def write_database(db, out_dir):
+	with gzip.open(os.path.join(out_dir, 'database.json.gz'), 'wt') as fp:
+		json.dump(db, fp, indent=1)
+	df = pd.DataFrame(db)
+	df.POSTAL = df.POSTAL.astype(int)
+	df.to_csv(os.path.join(out_dir, 'database.csv.gz'), index=False)
+
+
+def make_queries(db, n, seed=0):
+	# a mix of the query shapes seen in practice: postal codes, '<blk> <road>', '<road> blk <blk>', abbreviations,
+	# bracketed building names, bare road names, and addresses which do not exist
+	rng = np.random.default_rng(seed)
+	queries = []
+	for i in rng.integers(len(db), size=n):
+		e, kind = db[i], rng.integers(7)
+		road = e['ROAD_NAME']
+		if kind == 0:
+			queries += [int(e['POSTAL'])]
+		elif kind == 1:
+			queries += ['%s %s' % (e['BLK_NO'], road.lower())]
+		elif kind == 2:
+			queries += ['%s Blk %s' % (road.title(), e['BLK_NO'])]
+		elif kind == 3:
+			queries += [' '.join(ABBR.get(w, w) for w in ('%s %s' % (e['BLK_NO'], road)).split())]
+		elif kind == 4 and e['BUILDING'] != 'NIL':
+			queries += ['%s (%s)' % (road, e['BUILDING'])]
+		elif kind == 5:
+			queries += [road]
+		else:
+			queries += ['%d NOWHERE %s' % (rng.integers(1000), road.split()[-1])]
+	return queries
+
+
+def make_events(db, n, days=30, seed=0, with_address=True):
+	# time-stamped events at random database locations, about 1/3 of them referring to addresses by postal code
+	rng = np.random.default_rng(seed)
+	idx = rng.integers(len(db), size=n)
+	times = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, days * 86400, n), unit='s')
+	df = pd.DataFrame({'count': rng.integers(1, 5, n)}, index=pd.DatetimeIndex(times).sort_values())
+	if with_address:
+		df['address'] = [int(db[i]['POSTAL']) if i % 3 == 0 else '%s %s' % (db[i]['BLK_NO'], db[i]['ROAD_NAME']) for i in idx]
+	else:
+		df['latitude'] = [db[i]['LATITUDE'] for i in idx]
+		df['longitude'] = [db[i]['LONGITUDE'] for i in idx]
+	return df
+
+
+def latency_stats(secs):
+	ms = np.asarray(secs) * 1000
+	if not len(ms):
+		return {}
+	return {'n': len(ms), 'mean_ms': ms.mean(), 'p50_ms': np.percentile(ms, 50), 'p90_ms': np.percentile(ms, 90),
+	        'p99_ms': np.percentile(ms, 99), 'max_ms': ms.max()}
+
+
+def peak_rss_mb():
+	# ru_maxrss is in KB on Linux and in bytes on macOS
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def timed(fn, *args, **kwargs):
+	t0 = time.perf_counter()
+	ret = fn(*args, **kwargs)
+	return time.perf_counter() - t0, ret
+
+
+def new_map():
+	import folium
+	return folium.Map([1.34, 103.82], zoom_start=11, control_scale=True)
+
+
+def html_size(map_obj):
+	t, html = timed(map_obj.get_root().render)
+	return t, len(html.encode('utf8'))
+
+
+def bench_dbsearch(opt):
+	from dbsearch import AddrDB
+	load_s, db = timed(AddrDB, 'database.json.gz')
+	queries = make_queries(db.db, opt.queries, opt.seed)
+	lat = [timed(db.__getitem__, q)[0] for q in queries]
+	hits = sum(1 for q in queries if db[q])
+	return {'load_s': load_s, 'hit_rate': hits / len(queries), 'throughput_qps': len(lat) / sum(lat), **latency_stats(lat)}
+
+
+def bench_suggest(opt):
+	# prefix autocomplete: every query string cut after a random number of characters
+	from dbsearch import AddrDB
+	db = AddrDB('database.json.gz')
+	build_s, _ = timed(db.build_prefix_index)
+	rng = np.random.default_rng(opt.seed)
+	prefixes = [q[:rng.integers(1, len(q) + 1)] for q in make_queries(db.db, opt.queries, opt.seed) if type(q) == str and q]
+	lat = [timed(db.suggest, p)[0] for p in prefixes]
+	return {'build_s': build_s, 'n_keys': len(db.prefix_keys), 'throughput_qps': len(lat) / sum(lat), **latency_stats(lat)}
+
+
+def bench_svy21(opt):
+	# SVY21 <=> WGS84 throughput on random points over Singapore, and the error against the X/Y of the station data
+	from svy21 import wgs84_to_svy21, svy21_to_wgs84
+	rng = np.random.default_rng(opt.seed)
+	n = opt.events * 10
+	lat, lon = rng.uniform(1.2, 1.47, n), rng.uniform(103.6, 104.1, n)
+	fwd_s, (x, y) = timed(wgs84_to_svy21, lat, lon)
+	inv_s, _ = timed(svy21_to_wgs84, x, y)
+	here = os.path.dirname(os.path.abspath(__file__))
+	pts = [loc for fn in ['mrt_stations.json', 'lrt_stations.json'] for stn in json.load(open(os.path.join(here, fn))) for loc in stn['Possible Locations']]
+	ref = np.array([[float(p[k]) for k in ['LATITUDE', 'LONGITUDE', 'X', 'Y']] for p in pts])
+	x, y = wgs84_to_svy21(ref[:, 0], ref[:, 1])
+	return {'n': n, 'forward_mpts_per_s': n / fwd_s / 1e6, 'inverse_mpts_per_s': n / inv_s / 1e6,
+	        'max_error_m': float(np.hypot(x - ref[:, 2], y - ref[:, 3]).max())}
+
+
+def legacy_variants(addrname, abbr_dct, optional):
+	# the query normalization as done before QueryNormalizer: a regex substitution per rule, redone for every variant
+	import re
+	trim = lambda s: ' '.join(s.split())
+	ret = []
+	for abbr, opt in [({}, []), (abbr_dct, []), (abbr_dct, optional)]:
+		name = trim(re.sub('([&#@()])', ' \\1 ', addrname.upper().replace(',', ' ')))
+		for k, v in abbr.items():
+			name = name.replace(' %s ' % k, ' %s ' % v)
+			name = re.sub(' %s$' % k, ' %s' % v, name)
+		for k in opt:
+			name = name.replace(' %s ' % k, ' ')
+			name = re.sub(' %s$' % k, '', name)
+		ret += [name.split()]
+	return ret
+
+
+def bench_normalizer(opt):
+	# microbenchmark of the per-query cost of producing the three normalized search variants
+	from dbsearch import QueryNormalizer, ABBR_DCT, OPTIONAL_WORDS
+	queries = [q for q in make_queries(make_database(1000, opt.seed), opt.queries * 10, opt.seed) if type(q) == str]
+	normalizer = QueryNormalizer(ABBR_DCT, OPTIONAL_WORDS)
+	legacy_s, _ = timed(lambda: [legacy_variants(q, ABBR_DCT, OPTIONAL_WORDS) for q in queries])
+	new_s, _ = timed(lambda: [normalizer.variants(q) for q in queries])
+	return {'n': len(queries), 'legacy_us_per_query': legacy_s / len(queries) * 1e6, 'us_per_query': new_s / len(queries) * 1e6,
+	        'speedup': legacy_s / new_s}
+
+
+def bench_dfsearch(opt):
+	from dfsearch import AddrDB
+	load_s, db = timed(AddrDB, 'database.csv.gz')
+	queries = make_queries(db.db.to_dict('records'), opt.queries // 4, opt.seed)
+	lat = [timed(db.__getitem__, q)[0] for q in queries]
+	return {'load_s': load_s, 'throughput_qps': len(lat) / sum(lat), **latency_stats(lat)}
+
+
+def bench_geocode(opt):
+	import draw_util
+	queries = make_queries(draw_util.addr_db.db, opt.queries, opt.seed)
+	# per-query latency of the uncached lookup, then batch throughput of the deduplicating bulk geocoder
+	lat = [timed(draw_util.geocode, [q])[0] for q in queries[:opt.queries // 4]]
+	batch = queries * 10
+	batch_s, geo = timed(draw_util.geocode, batch)
+	return {'batch_rows': len(batch), 'batch_s': batch_s, 'batch_throughput_rps': len(batch) / batch_s,
+	        'found_rate': float(np.mean(~np.isnan(geo[:, 0]))), **latency_stats(lat)}
+
+
+def bench_countmaps(opt):
+	import draw_util
+	db = draw_util.addr_db.db
+	df = make_events(db, opt.events, seed=opt.seed, with_address=False).reset_index(drop=True)
+	dct = {q: 1 for q in make_queries(db, opt.queries // 4, opt.seed)}
+	m = new_map()
+	t_df, _ = timed(draw_util.showCountmaps, {'blue': df}, m, add_args=[['weight', 1], ['fill', True], ['fillOpacity', '10%']])
+	t_dct, _ = timed(draw_util.showCountmaps, {'red': dct}, m)
+	render_s, size = html_size(m)
+	return {'rows': len(df), 'build_df_s': t_df, 'build_dict_s': t_dct, 'render_s': render_s, 'html_bytes': size}
+
+
+def bench_heatmaps(opt):
+	import draw_util
+	db = draw_util.addr_db.db
+	res = {}
+	for name, df, kwargs in [('timed_addr', make_events(db, opt.events, seed=opt.seed), {'smooth': -2}),
+	                         ('static_geo', make_events(db, opt.events, seed=opt.seed, with_address=False).reset_index(drop=True), {}),
+	                         ('static_pyramid', make_events(db, opt.events, seed=opt.seed, with_address=False).reset_index(drop=True), {'pyramid': True})]:
+		m = new_map()
+		t, _ = timed(draw_util.showHeatmaps, {'red': df}, m, **kwargs)
+		render_s, size = html_size(m)
+		res.update({name + '_rows': len(df), name + '_build_s': t, name + '_render_s': render_s, name + '_html_bytes': size})
+	return res
+
+
+def bench_cube(opt):
+	# build an aggregate cube once, then change the time window and frequency of a heatmap from the cube
+	import draw_util
+	from cube import AggCube
+	df = make_events(draw_util.addr_db.db, opt.events, seed=opt.seed)
+	cube = AggCube(bin_freq='1h')
+	build_s, _ = timed(cube.add, df)
+	rollup_1d_s, _ = timed(cube.rollup, '1D')
+	rollup_6h_s, frames = timed(cube.rollup, '6h', '2020-01-08', '2020-01-15')
+	heatmap_s, _ = timed(draw_util.showHeatmaps, {'red': frames}, new_map(), freq='6h')
+	raw_s, _ = timed(draw_util.showHeatmaps, {'red': df.loc['2020-01-08':'2020-01-14T23:59:59']}, new_map(), freq='6h')
+	return {'rows': len(df), 'entries': len(cube), 'build_s': build_s, 'rollup_1D_ms': rollup_1d_s * 1000,
+	        'rollup_6h_window_ms': rollup_6h_s * 1000, 'heatmap_from_cube_s': heatmap_s, 'heatmap_from_events_s': raw_s}
+
+
+def bench_batch(opt):
+	# one heatmap and one count-map per day of the events, rendered by batchmaps.renderBatch()
+	import tempfile, shutil
+	import draw_util
+	from batchmaps import renderBatch
+	df = make_events(draw_util.addr_db.db, opt.events, days=10, seed=opt.seed)
+	specs = []
+	for day, df1 in df.groupby(df.index.normalize()):
+		specs += [{'out': 'heat_%s.html' % day.date(), 'kind': 'heatmaps', 'layers': {'red': df1}, 'options': {'freq': '1h'}},
+		          {'out': 'count_%s.html' % day.date(), 'kind': 'countmaps', 'layers': {'blue': df1.reset_index(drop=True)}}]
+	out_dir = tempfile.mkdtemp()
+	try:
+		report = renderBatch(specs, out_dir)
+	finally:
+		shutil.rmtree(out_dir)
+	return {k: report[k] for k in ['maps', 'geocode_s', 'render_s', 'total_s', 'maps_per_s', 'html_bytes']}
+
+
+def bench_replay(opt):
+	# replay the example data shipped with the repo, most of their addresses will not be in the synthetic database
+	import draw_util
+	res = {}
+	fn = os.path.join(opt.repo_dir, 'example', 'dengue.csv.gz')
+	if os.path.exists(fn):
+		df = pd.read_csv(fn)
+		m = new_map()
+		t, _ = timed(draw_util.showCountmaps, {'blue': df}, m)
+		render_s, size = html_size(m)
+		res.update({'dengue_rows': len(df), 'dengue_build_s': t, 'dengue_render_s': render_s, 'dengue_html_bytes': size})
+	fn = os.path.join(opt.repo_dir, 'example', 'sc_data.csv.gz')
+	if os.path.exists(fn):
+		df = pd.read_csv(fn, parse_dates=['t']).set_index('t').rename(columns={'postalcode': 'address'})
+		m = new_map()
+		t, _ = timed(draw_util.showHeatmaps, {'red': df}, m)
+		render_s, size = html_size(m)
+		res.update({'sc_rows': len(df), 'sc_build_s': t, 'sc_render_s': render_s, 'sc_html_bytes': size})
+	return res
+
+
+BENCHMARKS = {'normalizer': bench_normalizer, 'dbsearch': bench_dbsearch, 'suggest': bench_suggest, 'dfsearch': bench_dfsearch, 'geocode': bench_geocode,
+              'countmaps': bench_countmaps, 'heatmaps': bench_heatmaps, 'replay': bench_replay, 'svy21': bench_svy21,
+              'cube': bench_cube, 'batch': bench_batch}
+
+
+def run_one(name, opt):
+	# every benchmark runs in its own process, so that peak RSS is not inherited from the previous ones
+	res = BENCHMARKS[name](opt)
+	res['peak_rss_mb'] = peak_rss_mb()
+	return {k: (float(v) if isinstance(v, (np.floating, np.integer)) else v) for k, v in res.items()}
+
+
+def compare(new, old, fp=sys.stdout):
+	# print new/old for every common metric; for *_s, *_ms, *_bytes and *_mb, a ratio < 1 is an improvement
+	for name in new['results']:
+		if name not in old['results']:
+			continue
+		print('[%s]' % name, file=fp)
+		for k, v in new['results'][name].items():
+			v0 = old['results'][name].get(k)
+			if isinstance(v, (int, float)) and isinstance(v0, (int, float)) and v0:
+				print('  %-28s %14.4f %14.4f  x%.3f' % (k, v0, v, v / v0), file=fp)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] 1>output 2>progress', description='benchmark search, geocoding and rendering on a synthetic database',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--work-dir', '-w', help='directory for the synthetic database', default='bench_work')
+	parser.add_argument('--db-size', '-n', help='number of synthetic address records', type=int, default=20000)
+	parser.add_argument('--queries', '-q', help='number of search queries', type=int, default=2000)
+	parser.add_argument('--events', '-e', help='number of events for count-maps and heat-maps', type=int, default=100000)
+	parser.add_argument('--seed', '-s', help='random seed', type=int, default=0)
+	parser.add_argument('--only', help='run only these benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+	parser.add_argument('--output', '-o', help='output JSON file, "-" for STDOUT', default='-')
+	parser.add_argument('--compare', '-c', help='previous output JSON file to compare against', default=None)
+	# nargs='?': optional positional argument; action='append': multiple instances of the arg; type=; default=
+	opt = parser.parse_args()
+	opt.repo_dir = os.path.dirname(os.path.abspath(__file__))
+	opt.work_dir = os.path.abspath(opt.work_dir)
+	opt.output = opt.output if opt.output == '-' else os.path.abspath(opt.output)
+	opt.compare = opt.compare and os.path.abspath(opt.compare)
+
+	# the synthetic database is reused across runs with the same size and seed
+	os.makedirs(opt.work_dir, exist_ok=True)
+	stamp = os.path.join(opt.work_dir, 'database.stamp')
+	if not os.path.exists(stamp) or open(stamp).read() != '%d %d' % (opt.db_size, opt.seed):
+		print('Generating synthetic database of %d records ...' % opt.db_size, file=sys.stderr, flush=True)
+		write_database(make_database(opt.db_size, opt.seed), opt.work_dir)
+		with open(stamp, 'w') as fp:
+			fp.write('%d %d' % (opt.db_size, opt.seed))
+
+	# draw_util loads database.json.gz from the current directory on import
+	sys.path.insert(0, opt.repo_dir)
+	os.chdir(opt.work_dir)
+
+	results = {}
+	ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+	for name in opt.only:
+		print('Running %s ...' % name, file=sys.stderr, flush=True)
+		with ctx.Pool(1) as pool:
+			results[name] = pool.apply(run_one, (name, opt))
+
+	out = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'numpy': np.__version__,
+	                'pandas': pd.__version__, 'machine': platform.machine(), 'db_size': opt.db_size, 'queries': opt.queries,
+	                'events': opt.events, 'seed': opt.seed},
+	       'results': results}
+	txt = json.dumps(out, indent=1)
+	if opt.output == '-':
+		print(txt)
+	else:
+		with open(opt.output, 'w') as fp:
+			fp.write(txt)
+
+	if opt.compare:
+		compare(out, json.load(open(opt.compare)), sys.stderr)
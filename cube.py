@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Spatio-temporal aggregate cube of geocoded events, requires draw_util
+# Counts are kept per (fine time bin, location id) as sorted sparse arrays, so that any time window is two binary
+# searches away and rolling up to a coarser frequency is one bincount; the result feeds showHeatmaps()/showCountmaps()
+# without re-reading or re-geocoding the raw events.
+
+import os, sys, json, argparse
+from draw_util import *
+
+
+def location_keys(lat, lon):
+	# one int64 per location, coordinates rounded to 6 decimals (~0.1m) as in aggGeoCount()
+	lat_u = np.round((np.asarray(lat, dtype=float) + 90) * 1e6).astype(np.int64)
+	lon_u = np.round((np.asarray(lon, dtype=float) + 180) * 1e6).astype(np.int64)
+	return (lat_u << 29) | lon_u
+
+
+class AggCube:
+	def __init__(self, fn=None, bin_freq='1h'):
+		# bin_freq: the finest time resolution kept, every roll-up frequency must be a multiple of it
+		self.fn = fn
+		self.bin_freq = bin_freq
+		self.origin = None
+		self.lat, self.lon, self.loc_keys = np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+		self.bins, self.locs, self.counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+		if fn and os.path.exists(fn):
+			self.load(fn)
+
+	def __len__(self):
+		return len(self.bins)
+
+	@property
+	def bin_delta(self):
+		return pd.to_timedelta(self.bin_freq)
+
+	@property
+	def time_range(self):
+		# OUTPUT: the start of the first and of the last non-empty bin
+		if not len(self):
+			return None, None
+		return self.origin + self.bin_delta * int(self.bins[0]), self.origin + self.bin_delta * int(self.bins[-1])
+
+	def bin_of(self, times):
+		# map times onto fine bin numbers, bins are aligned to midnight of the first day in the cube
+		return np.asarray((pd.DatetimeIndex(times) - self.origin) // self.bin_delta, dtype=np.int64)
+
+	def location_ids(self, lat, lon):
+		# OUTPUT: the location id of every point, new locations are appended to the location table
+		keys = location_keys(lat, lon)
+		ids = pd.Index(self.loc_keys).get_indexer(keys)
+		new = ids < 0
+		if new.any():
+			new_keys, first, inv = np.unique(keys[new], return_index=True, return_inverse=True)
+			ids[new] = len(self.loc_keys) + inv
+			self.loc_keys = np.concatenate([self.loc_keys, new_keys])
+			self.lat = np.concatenate([self.lat, np.round(np.asarray(lat, dtype=float)[new][first], 6)])
+			self.lon = np.concatenate([self.lon, np.round(np.asarray(lon, dtype=float)[new][first], 6)])
+		return ids
+
+	def add(self, df, cache=None):
+		# INPUT: events, pd.DataFrame(columns=['address' or 'latitude'+'longitude' or 'x'+'y', 'count'], index=pd.DatetimeIndex)
+		#        as in showHeatmaps(), <cache> as in geocode()
+		# OUTPUT: the number of events added
+		df = inferLatLon(df, cache)
+		if df.empty:
+			return 0
+		if self.origin is None:
+			self.origin = df.index.min().normalize()
+		bins = self.bin_of(df.index)
+		locs = self.location_ids(df['latitude'].values, df['longitude'].values)
+		self.merge(bins, locs, df['count'].values.astype(float))
+		return len(df)
+
+	def merge(self, bins, locs, counts):
+		# sum (bin, loc, count) triplets into the cube, keeping it sorted by (bin, loc)
+		key = np.concatenate([self.bins, bins]) * (1 << 32) + np.concatenate([self.locs, locs])
+		uniq, inv = np.unique(key, return_inverse=True)
+		self.counts = np.bincount(inv, weights=np.concatenate([self.counts, counts]), minlength=len(uniq))
+		self.bins, self.locs = uniq >> 32, uniq & 0xffffffff
+		return self
+
+	def window(self, start=None, end=None):
+		# OUTPUT: the slice of the sorted arrays in the time window [start, end), None means unbounded
+		if self.origin is None:
+			return slice(0, 0)
+		lo = 0 if start is None else np.searchsorted(self.bins, self.bin_of([pd.Timestamp(start)])[0], 'left')
+		hi = len(self) if end is None else np.searchsorted(self.bins, self.bin_of([pd.Timestamp(end) - pd.Timedelta(1)])[0], 'right')
+		return slice(lo, hi)
+
+	def slice(self, start=None, end=None):
+		# OUTPUT: a new cube holding only the bins in [start, end), sharing the location table
+		sel = self.window(start, end)
+		cube = AggCube(bin_freq=self.bin_freq)
+		cube.origin, cube.lat, cube.lon, cube.loc_keys = self.origin, self.lat, self.lon, self.loc_keys
+		cube.bins, cube.locs, cube.counts = self.bins[sel], self.locs[sel], self.counts[sel]
+		return cube
+
+	def rollup(self, freq='1D', start=None, end=None):
+		# OUTPUT: the counts summed per (frame of <freq>, location) in [start, end), frames are aligned to midnight of the
+		#         first day in the cube as in showHeatmaps(), as
+		#         pd.DataFrame(columns=['latitude', 'longitude', 'count'], index=pd.DatetimeIndex of the frame starts)
+		step = pd.to_timedelta(freq) / self.bin_delta
+		if step < 1 or step != int(step):
+			raise ValueError('freq=%s is not a multiple of the cube bin_freq=%s' % (freq, self.bin_freq))
+		sel = self.window(start, end)
+		frames = self.bins[sel] // int(step)
+		key = frames * (1 << 32) + self.locs[sel]
+		uniq, inv = np.unique(key, return_inverse=True)
+		cnt = np.bincount(inv, weights=self.counts[sel], minlength=len(uniq))
+		locs = uniq & 0xffffffff
+		index = pd.DatetimeIndex(self.origin + pd.to_timedelta(freq) * (uniq >> 32), name='datetime') if len(uniq) else pd.DatetimeIndex([], name='datetime')
+		return pd.DataFrame({'latitude': self.lat[locs], 'longitude': self.lon[locs], 'count': cnt}, index=index)
+
+	def totals(self, start=None, end=None):
+		# OUTPUT: the counts summed per location in [start, end), pd.DataFrame(columns=['latitude', 'longitude', 'count'])
+		sel = self.window(start, end)
+		cnt = np.bincount(self.locs[sel], weights=self.counts[sel], minlength=len(self.loc_keys))
+		ids = np.flatnonzero(cnt)
+		return pd.DataFrame({'latitude': self.lat[ids], 'longitude': self.lon[ids], 'count': cnt[ids]})
+
+	def save(self, fn=None):
+		fn = fn or self.fn
+		meta = {'bin_freq': self.bin_freq, 'origin': None if self.origin is None else str(self.origin)}
+		with open(fn, 'wb') as fp:
+			np.savez_compressed(fp, meta=json.dumps(meta), latitude=self.lat, longitude=self.lon,
+			                    bins=self.bins, locs=self.locs, counts=self.counts)
+		return fn
+
+	def load(self, fn):
+		with np.load(fn) as data:
+			meta = json.loads(str(data['meta']))
+			self.lat, self.lon = data['latitude'], data['longitude']
+			self.bins, self.locs, self.counts = data['bins'], data['locs'], data['counts']
+		self.loc_keys = location_keys(self.lat, self.lon)
+		self.bin_freq = meta['bin_freq']
+		self.origin = None if meta['origin'] is None else pd.Timestamp(meta['origin'])
+		return self
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] cube.npz [<events.csv] [1>output.csv]',
+	                                 description='add time-stamped events (datetime, address or latitude+longitude, count) to an aggregate cube, '
+	                                             'or roll the cube up into per-frame counts',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('cube_file', help='the cube file, created if it does not exist')
+	parser.add_argument('--bin-freq', '-b', help='the finest time resolution of a new cube', default='1h')
+	parser.add_argument('--rollup', '-r', help='instead of adding events, output the counts per frame of this frequency as CSV', default=None)
+	parser.add_argument('--start', '-s', help='start of the time window of --rollup', default=None)
+	parser.add_argument('--end', '-e', help='end (exclusive) of the time window of --rollup', default=None)
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	cube = AggCube(cube_file, bin_freq)
+	if rollup:
+		cube.rollup(rollup, start, end).to_csv(sys.stdout)
+	else:
+		df = pd.read_csv(sys.stdin, index_col='datetime', parse_dates=['datetime'])
+		n = cube.add(df)
+		cube.save()
+		print('%d events added, %d entries in %s' % (n, len(cube), cube_file), file=sys.stderr)
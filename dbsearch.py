@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import os, sys, gzip, json, argparse, re
+import os, sys, gzip, json, argparse, re, bisect
 import numpy as np
 from collections import *
+from telemetry import stats
 
 
 def Open(fn, mode='r', **kwargs):
@@ -22,9 +23,86 @@ def isPostal(s):
 
 trim = lambda s: ' '.join(s.split())
 
+ABBR_DCT = {'RD': 'ROAD', 'LK': 'LINK', 'LN': 'LANE', 'PK': 'PARK', 'AVE': 'AVENUE', 'DR': 'DRIVE', 'ST': 'STREET'}
+OPTIONAL_WORDS = ['ROAD', 'LINK', 'LANE', 'STREET', 'AVENUE', 'DRIVE']
+
+
+class QueryNormalizer:
+	# Normalizes an address query into the word lists searched by AddrDB.search(): the raw query, the query with
+	# abbreviations expanded, and the query with abbreviations expanded and optional words removed.
+	# The rules are compiled once into a dict and a set, and all three variants come out of a single pass over the words.
+	# The first word is never expanded or removed, e.g., the 'ST' in 'ST GEORGE'S ROAD' stands for SAINT.
+	punct = re.compile('([&#@()])')
+
+	def __init__(self, abbr_dct=ABBR_DCT, optional=OPTIONAL_WORDS):
+		self.abbr_dct = {k.upper(): v.upper() for k, v in abbr_dct.items()}
+		self.optional = set(w.upper() for w in optional)
+
+	def tokenize(self, addrname):
+		return self.punct.sub(' \\1 ', addrname.upper().replace(',', ' ')).split()
+
+	def variants(self, addrname):
+		names = self.tokenize(addrname)
+		abbr, opt = names[:1], names[:1]
+		for w in names[1:]:
+			w = self.abbr_dct.get(w, w)
+			abbr += [w]
+			if w not in self.optional:
+				opt += [w]
+		return names, abbr, opt
+
+	def __call__(self, addrname):
+		return self.variants(addrname)[2]
+
+
+BLK_PATTN = re.compile('^[0-9]+[A-Z]?$')
+
+
+def split_query(names):
+	# split the words of a normalized query into (the remaining words, the block number after BLK/BLOCK or None,
+	#                                             the list of phrases inside brackets)
+	names = list(names)
+
+	# try to extract BLK number
+	try:
+		blk_pos = names.index('BLK') if 'BLK' in names else (names.index('BLOCK') if 'BLOCK' in names else None)
+		blk = names[blk_pos + 1]
+		del names[blk_pos:blk_pos + 2]
+	except:
+		blk = None
+
+	# try to extract names inside ()
+	brack_data = []
+	try:
+		while '(' in names:
+			pos1 = names.index('(')
+			pos2 = names.index(')', pos1 + 1)
+			if pos2 > pos1 + 1:
+				brack_data += [' '.join(names[pos1 + 1:pos2])]
+			del names[pos1:pos2 + 1]
+	except:
+		names = [s for s in names if s not in ['(', ')']]
+
+	return names, blk, brack_data
+
+
+def group_centroids(keys, lat, lon):
+	# OUTPUT: {key: row index} and the centroid table with one row per distinct key:
+	#         [mean latitude, mean longitude, count, min latitude, min longitude, max latitude, max longitude]
+	if not len(keys):
+		return {}, np.empty((0, 7))
+	uniq, inv = np.unique(np.asarray(keys), return_inverse=True)
+	order = np.argsort(inv, kind='stable')
+	starts = np.r_[0, np.flatnonzero(np.diff(inv[order])) + 1]
+	cnt = np.bincount(inv).astype(float)
+	table = np.column_stack([np.bincount(inv, lat) / cnt, np.bincount(inv, lon) / cnt, cnt,
+	                         np.minimum.reduceat(lat[order], starts), np.minimum.reduceat(lon[order], starts),
+	                         np.maximum.reduceat(lat[order], starts), np.maximum.reduceat(lon[order], starts)])
+	return {k: i for i, k in enumerate(uniq.tolist())}, table
+
 
 class AddrDB:
-	def __init__(self, fn_or_fp=None):
+	def __init__(self, fn_or_fp=None, abbr_dct=ABBR_DCT, optional=OPTIONAL_WORDS):
 		if fn_or_fp == None:
 			txt = '[]'
 		elif type(fn_or_fp) == str:
@@ -35,12 +113,19 @@ class AddrDB:
 				txt = txt.decode('utf8', 'ignore')
 		self.db = json.loads(txt)
 		self.addr_lst = [i['ADDRESS'] for i in self.db]
-		self.abbr_dct = {'RD': 'ROAD', 'LK': 'LINK', 'LN': 'LANE', 'PK': 'PARK', 'AVE': 'AVENUE', 'DR': 'DRIVE', 'ST': 'STREET'}
-		self.optional = ['ROAD', 'LINK', 'LANE', 'STREET', 'AVENUE', 'DRIVE']
+		self.abbr_dct = dict(abbr_dct)
+		self.optional = list(optional)
+		self.normalizer = QueryNormalizer(self.abbr_dct, self.optional)
 		self.build_postal_db()
+		self.build_centroid_db()
+		self.build_block_index()
+		self.prefix_keys = None
 
 	def __getitem__(self, item):
-		return self.postal_db.get(int(item), []) if isPostal(item) else self.search(item)
+		if isPostal(item):
+			stats.count('search.postal')
+			return self.postal_db.get(int(item), [])
+		return self.search(item)
 
 	def build_postal_db(self):
 		self.postal_db = defaultdict(lambda: [])
@@ -49,59 +134,173 @@ class AddrDB:
 				self.postal_db[int(e['POSTAL'])] += [e]
 		return self.postal_db
 
+	def build_centroid_db(self):
+		# precompute the centroid of every postal code, road name and building name, see group_centroids()
+		# self.centroid_idx maps (kind, key) to a row of self.centroids, kind is 'POSTAL', 'ROAD' or 'BUILDING'
+		lat = np.array([e['LATITUDE'] for e in self.db], dtype=float)
+		lon = np.array([e['LONGITUDE'] for e in self.db], dtype=float)
+		self.centroid_idx, tables, n = {}, [], 0
+		for kind, field, valid, key in [('POSTAL', 'POSTAL', isPostal, int),
+		                                ('ROAD', 'ROAD_NAME', lambda v: v != 'NIL', lambda v: trim(v.upper())),
+		                                ('BUILDING', 'BUILDING', lambda v: v != 'NIL', lambda v: trim(v.upper()))]:
+			sel = np.array([bool(e[field]) and valid(e[field]) for e in self.db], dtype=bool)
+			idx, table = group_centroids([key(e[field]) for e, b in zip(self.db, sel) if b], lat[sel], lon[sel])
+			self.centroid_idx.update({(kind, k): n + i for k, i in idx.items()})
+			tables += [table]
+			n += len(table)
+		self.centroids = np.concatenate(tables)
+		return self.centroids
+
+	def build_block_index(self):
+		# direct lookup of the dominant query shapes, consulted before the phrase search over all addresses:
+		# self.road_blk_idx maps (road name, block number) to row numbers, self.building_idx maps building name to row numbers
+		self.road_blk_idx, self.building_idx = defaultdict(list), defaultdict(list)
+		for i, e in enumerate(self.db):
+			if e['ROAD_NAME'] and e['ROAD_NAME'] != 'NIL':
+				self.road_blk_idx[(trim(e['ROAD_NAME'].upper()), str(e['BLK_NO']).upper())] += [i]
+			if e['BUILDING'] and e['BUILDING'] != 'NIL':
+				self.building_idx[trim(e['BUILDING'].upper())] += [i]
+		self.road_blk_idx, self.building_idx = dict(self.road_blk_idx), dict(self.building_idx)
+		return self.road_blk_idx
+
+	def lookup(self, names, blk=None):
+		# OUTPUT: the row numbers of '<road> BLK <blk>', '<blk> <road>' or '<building>' by direct index lookup,
+		#         None if the query is none of these
+		if blk is not None:
+			rows, kind = self.road_blk_idx.get((' '.join(names), blk)), 'road_blk'
+		elif len(names) > 1 and BLK_PATTN.match(names[0]):
+			rows, kind = self.road_blk_idx.get((' '.join(names[1:]), names[0])), 'road_blk'
+		else:
+			rows, kind = self.building_idx.get(' '.join(names)), 'building'
+		if rows is not None:
+			stats.count('search.index.' + kind)
+		return rows
+
+	def centroid(self, item):
+		# OUTPUT: the centroid row of a postal code, or of an address name which is exactly a road or building name,
+		#         None if there is none
+		if isPostal(item):
+			i = self.centroid_idx.get(('POSTAL', int(item)))
+		else:
+			i = None
+			for names in self.normalizer.variants(item)[:2]:
+				key = ' '.join(names)
+				i = self.centroid_idx.get(('ROAD', key), self.centroid_idx.get(('BUILDING', key)))
+				if i is not None:
+					break
+		return None if i is None else self.centroids[i]
+
+	def geo(self, item):
+		# OUTPUT: [latitude, longitude] of a postal code or address name, None if not found
+		row = self.centroid(item)
+		if row is not None:
+			stats.count('geo.centroid')
+			return row[:2]
+		if isPostal(item):
+			return None
+		res = self.search(item)
+		return compute_mean_geo(res) if res else None
+
+	def build_prefix_index(self):
+		# sorted keys for prefix search: every building name, road name and address, and for building and road
+		# names also every word-suffix (so that 'EAST ST' finds 'JURONG EAST STREET 12')
+		# every key has a static rank: phrase starts before word-suffixes, then buildings, roads, addresses,
+		# then the most addresses first, then the shortest
+		self.prefix_phrases = [(key, kind, int(self.centroids[i, 2]), float(self.centroids[i, 0]), float(self.centroids[i, 1]))
+		                       for (kind, key), i in self.centroid_idx.items() if kind in ['BUILDING', 'ROAD']]
+		self.prefix_phrases += [(trim(e['ADDRESS']), 'ADDRESS', 1, e['LATITUDE'], e['LONGITUDE']) for e in self.db]
+		kind_order = {'BUILDING': 0, 'ROAD': 1, 'ADDRESS': 2}
+		entries = []
+		for pi, (text, kind, cnt, _, _) in enumerate(self.prefix_phrases):
+			words = text.split()
+			for j in (range(len(words)) if kind != 'ADDRESS' else [0]):
+				entries += [(' '.join(words[j:]), (j > 0, kind_order[kind], -cnt, len(text), text), pi)]
+		entries.sort(key=lambda t: t[0])
+		order = sorted(range(len(entries)), key=lambda i: entries[i][1])
+		self.prefix_rank = np.empty(len(entries), dtype=np.int32)
+		self.prefix_rank[order] = np.arange(len(entries), dtype=np.int32)
+		self.prefix_phrase = np.array([t[2] for t in entries], dtype=np.int32)
+		self.prefix_keys = [t[0] for t in entries]
+		return self.prefix_keys
+
+	def suggest(self, prefix, limit=10):
+		# OUTPUT: up to <limit> building names, road names and addresses starting with <prefix>, best ranked first,
+		#         as dicts of TEXT, TYPE ('BUILDING', 'ROAD' or 'ADDRESS'), COUNT (number of addresses), LATITUDE, LONGITUDE
+		if self.prefix_keys is None:
+			self.build_prefix_index()
+		names = self.normalizer.tokenize(prefix)
+		if not names:
+			return []
+		# complete words have their abbreviations expanded; the last word may still be being typed,
+		# so it is only expanded if nothing starts with it as typed
+		done = prefix[-1:].isspace()
+		words = [self.abbr_dct.get(w, w) for w in names[:-1]]
+		lasts = [names[-1], self.abbr_dct.get(names[-1], names[-1])]
+		lasts = lasts[1:] if done else lasts
+		for last in lasts:
+			# a completed last word matches the word itself or the word followed by more words
+			key = ' '.join(words + [last])
+			lo = bisect.bisect_left(self.prefix_keys, key)
+			hi = bisect.bisect_left(self.prefix_keys, key + (' \uffff' if done else '\uffff'), lo)
+			if hi > lo:
+				break
+		rank = self.prefix_rank[lo:hi]
+
+		# a phrase can match several of its word-suffixes, so fetch more candidates until <limit> distinct ones are found
+		out, k = [], min(len(rank), limit * 4)
+		while k:
+			top = np.argpartition(rank, k - 1)[:k] if k < len(rank) else np.arange(len(rank))
+			out = list(dict.fromkeys(self.prefix_phrase[lo + top[np.argsort(rank[top])]].tolist()))[:limit]
+			if len(out) == limit or k == len(rank):
+				break
+			k = min(len(rank), k * 4)
+		return [dict(zip(['TEXT', 'TYPE', 'COUNT', 'LATITUDE', 'LONGITUDE'], self.prefix_phrases[pi])) for pi in out]
+
 	def search(self, addrname):
-		res = self.search_full(addrname)
-		if res: return res
-		res = self.search_full(addrname, self.abbr_dct)
-		if res: return res
-		return self.search_full(addrname, self.abbr_dct, self.optional)
+		# stages: raw query, abbreviations expanded, abbreviations expanded and optional words removed
+		with stats.timer('search'):
+			res, prev = [], None
+			for stage, names in zip(['raw', 'abbr', 'optional'], self.normalizer.variants(addrname)):
+				# a variant identical to the previous one gives the same (empty) result
+				if names == prev:
+					continue
+				res = self.search_names(names)
+				if res:
+					stats.count('search.resolved.' + stage)
+					return res
+				prev = names
+			stats.count('search.not_found')
+			return res
 
 	def search_full(self, addrname, abbr={}, opt=[]):
-		name = addrname.upper().replace(',', ' ')
-		name = trim(re.sub('([&#@()])', ' \\1 ', name))
-		for k, v in abbr.items():
-			name = name.replace(' %s ' % k, ' %s ' % v)
-			name = re.sub(' %s$' % k, ' %s' % v, name)
-		for k in opt:
-			name = name.replace(' %s ' % k, ' ')
-			name = re.sub(' %s$' % k, '', name)
-		names = name.split()
-
-		# try to extract BLK number
-		try:
-			blk_pos = names.index('BLK') if 'BLK' in name else (names.index['BLOCK'] if 'BLOCK' in names else None)
-			blk = names[blk_pos + 1]
-			del names[blk_pos:blk_pos + 2]
-		except:
-			blk = None
+		return self.search_names(QueryNormalizer(abbr, opt)(addrname))
 
-		# try to extract names inside ()
-		brack_data = []
-		try:
-			while '(' in names:
-				pos1 = names.index('(')
-				pos2 = names.index(')', pos1 + 1)
-				if pos2 > pos1 + 1:
-					brack_data += [' '.join(names[pos1 + 1:pos2])]
-				del names[pos1:pos2 + 1]
-		except:
-			names = [s for s in names if s not in ['(', ')']]
+	def search_names(self, names):
+		names, blk, brack_data = split_query(names)
 
-		s_pattn = ' ' + ' '.join(names) + ' '
-		res = [self.db[i] for i, s in enumerate(self.addr_lst) if s_pattn in s]
+		rows = self.lookup(names, blk)
+		if rows is None:
+			s_pattn = ' ' + ' '.join(names) + ' '
+			rows = [i for i, s in enumerate(self.addr_lst) if s_pattn in s]
 
-		# confine search by block number
-		if blk != None and len(res) > 1:
-			res1 = [i for i in res if i['BLK_NO'] == blk]
-			res = res1 if res1 else res
+			# confine search by block number
+			if blk != None and len(rows) > 1:
+				rows1 = [i for i in rows if self.db[i]['BLK_NO'] == blk]
+				rows = rows1 if rows1 else rows
+				stats.count('search.blk_confined' if rows1 else 'search.blk_unmatched')
 
-		# confine search by names in brackets
-		while brack_data and len(res) > 1:
-			e = ' %s ' % brack_data.pop()
-			res1 = [i for i in res if e in i['ADDRESS']]
-			res = res1 if res1 else res
+		# confine search by names in brackets, a building name by lookup, anything else by substring
+		while brack_data and len(rows) > 1:
+			e = brack_data.pop()
+			building = set(self.building_idx.get(e, []))
+			rows1 = [i for i in rows if i in building] if building else []
+			if not rows1:
+				e = ' %s ' % e
+				rows1 = [i for i in rows if e in self.addr_lst[i]]
+			rows = rows1 if rows1 else rows
+			stats.count('search.bracket_confined' if rows1 else 'search.bracket_unmatched')
 
-		return res
+		return [self.db[i] for i in rows]
 
 
 def compute_mean_geo(res):
@@ -115,16 +314,22 @@ if __name__ == '__main__':
 	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument('--addr-db', '-d', help='Singapore address database file', type=str, default='database.json.gz')
 	parser.add_argument('--single-line', '-s', help='output single-line JSON format')
+	parser.add_argument('--abbr', '-a', help='extra abbreviations to expand, e.g., CRES=CRESCENT TER=TERRACE', nargs='*', default=[])
+	parser.add_argument('--suggest', '-g', help='treat every input line as a prefix and output up to this many suggestions', type=int, default=0)
+	parser.add_argument('--stats', dest='stats_file', help='collect search statistics and write them as JSON to this file on exit', default=None)
 	# nargs='?': optional positional argument; action='append': multiple instances of the arg; type=; default=
 	opt = parser.parse_args()
 	globals().update(vars(opt))
 
-	db = AddrDB(addr_db)
+	if stats_file:
+		stats.enable()
+
+	db = AddrDB(addr_db, abbr_dct={**ABBR_DCT, **dict(a.split('=', 1) for a in abbr)})
 
 	while True:
 		try:
 			L = input()
-			res = db[L] if L else []
+			res = (db.suggest(L, suggest) if suggest else db[L]) if L else []
 			if single_line:
 				print(res)
 			else:
@@ -132,3 +337,6 @@ if __name__ == '__main__':
 				print(flush=True)
 		except:
 			break
+
+	if stats_file:
+		stats.dump(stats_file)
@@ -4,6 +4,8 @@ import os, sys, gzip, json, argparse, re
 import numpy as np
 import pandas as pd
 from collections import *
+from telemetry import stats
+from dbsearch import QueryNormalizer, ABBR_DCT, OPTIONAL_WORDS, BLK_PATTN, group_centroids, split_query
 
 
 def Open(fn, mode='r', **kwargs):
@@ -26,68 +28,133 @@ trim = lambda s: ' '.join(s.split())
 
 class AddrDB:
 	db_cols = ['ADDRESS', 'BLK_NO', 'BUILDING', 'LATITUDE', 'LONGITUDE', 'POSTAL', 'ROAD_NAME', 'X', 'Y']
-	def __init__(self, fn_or_df = None):
+	def __init__(self, fn_or_df = None, abbr_dct=ABBR_DCT, optional=OPTIONAL_WORDS):
 		self.db = pd.read_csv(fn_or_df) if type(fn_or_df)==str else fn_or_df[self.db_cols]
 		self.addr_lst = self.db.ADDRESS.to_list()
-		self.abbr_dct = {'RD': 'ROAD', 'LK': 'LINK', 'LN': 'LANE', 'PK': 'PARK', 'AVE': 'AVENUE', 'DR': 'DRIVE', 'ST': 'STREET'}
-		self.optional = ['ROAD', 'LINK', 'LANE', 'STREET', 'AVENUE', 'DRIVE']
+		self.abbr_dct = dict(abbr_dct)
+		self.optional = list(optional)
+		self.normalizer = QueryNormalizer(self.abbr_dct, self.optional)
+		self.build_centroid_db()
+		self.build_block_index()
 
 	def __getitem__(self, item):
-		return self.db[self.db.POSTAL == int(item)] if isPostal(item) else self.search(item)
+		if isPostal(item):
+			stats.count('search.postal')
+			return self.db[self.db.POSTAL == int(item)]
+		return self.search(item)
+
+	def build_centroid_db(self):
+		# precompute the centroid of every postal code, road name and building name, see dbsearch.group_centroids()
+		# self.centroid_idx maps (kind, key) to a row of self.centroids, kind is 'POSTAL', 'ROAD' or 'BUILDING'
+		lat, lon = self.db.LATITUDE.values.astype(float), self.db.LONGITUDE.values.astype(float)
+		self.centroid_idx, tables, n = {}, [], 0
+		for kind, col in [('POSTAL', 'POSTAL'), ('ROAD', 'ROAD_NAME'), ('BUILDING', 'BUILDING')]:
+			vals = self.db[col]
+			if kind == 'POSTAL':
+				sel = (vals > 0).values
+				keys = vals.values[sel].astype(int)
+			else:
+				sel = (vals.notna() & (vals != 'NIL')).values
+				keys = vals[sel].astype(str).str.upper().str.split().str.join(' ').values
+			idx, table = group_centroids(keys, lat[sel], lon[sel])
+			self.centroid_idx.update({(kind, k): n + i for k, i in idx.items()})
+			tables += [table]
+			n += len(table)
+		self.centroids = np.concatenate(tables)
+		return self.centroids
+
+	def build_block_index(self):
+		# direct lookup of the dominant query shapes, see dbsearch.AddrDB.build_block_index(), with positional row numbers;
+		# groupby() drops the NaN keys of NIL names
+		key = lambda col: self.db[col].astype(str).str.upper().str.split().str.join(' ').where(self.db[col].notna() & (self.db[col] != 'NIL'))
+		self.blk_lst = self.db.BLK_NO.astype(str).str.upper().values
+		pos = pd.Series(np.arange(len(self.db)))
+		self.road_blk_idx = pos.groupby([key('ROAD_NAME').values, self.blk_lst]).indices
+		self.building_idx = pos.groupby(key('BUILDING').values).indices
+		return self.road_blk_idx
+
+	def lookup(self, names, blk=None):
+		# OUTPUT: the row numbers of '<road> BLK <blk>', '<blk> <road>' or '<building>' by direct index lookup,
+		#         None if the query is none of these
+		if blk is not None:
+			rows, kind = self.road_blk_idx.get((' '.join(names), blk)), 'road_blk'
+		elif len(names) > 1 and BLK_PATTN.match(names[0]):
+			rows, kind = self.road_blk_idx.get((' '.join(names[1:]), names[0])), 'road_blk'
+		else:
+			rows, kind = self.building_idx.get(' '.join(names)), 'building'
+		if rows is not None:
+			stats.count('search.index.' + kind)
+		return rows
+
+	def centroid(self, item):
+		# OUTPUT: the centroid row of a postal code, or of an address name which is exactly a road or building name,
+		#         None if there is none
+		if isPostal(item):
+			i = self.centroid_idx.get(('POSTAL', int(item)))
+		else:
+			i = None
+			for names in self.normalizer.variants(item)[:2]:
+				key = ' '.join(names)
+				i = self.centroid_idx.get(('ROAD', key), self.centroid_idx.get(('BUILDING', key)))
+				if i is not None:
+					break
+		return None if i is None else self.centroids[i]
+
+	def geo(self, item):
+		# OUTPUT: [latitude, longitude] of a postal code or address name, None if not found
+		row = self.centroid(item)
+		if row is not None:
+			stats.count('geo.centroid')
+			return row[:2]
+		if isPostal(item):
+			return None
+		res = self.search(item)
+		return None if res.empty else compute_mean_geo(res)
 
 	def search(self, addrname):
-		res = self.search_full(addrname)
-		if not res.empty: return res
-		res = self.search_full(addrname, self.abbr_dct)
-		if not res.empty: return res
-		return self.search_full(addrname, self.abbr_dct, self.optional)
+		# stages: raw query, abbreviations expanded, abbreviations expanded and optional words removed
+		with stats.timer('search'):
+			res, prev = self.db.iloc[[]], None
+			for stage, names in zip(['raw', 'abbr', 'optional'], self.normalizer.variants(addrname)):
+				# a variant identical to the previous one gives the same (empty) result
+				if names == prev:
+					continue
+				res = self.search_names(names)
+				if not res.empty:
+					stats.count('search.resolved.' + stage)
+					return res
+				prev = names
+			stats.count('search.not_found')
+			return res
 
 	def search_full(self, addrname, abbr={}, opt=[]):
-		name = addrname.upper().replace(',', ' ')
-		name = trim(re.sub('([&#@()])', ' \\1 ', name))
-		for k, v in abbr.items():
-			name = name.replace(' %s ' % k, ' %s ' % v)
-			name = re.sub(' %s$' % k, ' %s' % v, name)
-		for k in opt:
-			name = name.replace(' %s ' % k, ' ')
-			name = re.sub(' %s$' % k, '', name)
-		names = name.split()
-
-		# try to extract BLK number
-		try:
-			blk_pos = names.index('BLK') if 'BLK' in name else (names.index['BLOCK'] if 'BLOCK' in names else None)
-			blk = names[blk_pos + 1]
-			del names[blk_pos:blk_pos + 2]
-		except:
-			blk = None
-
-		# try to extract names inside ()
-		brack_data = []
-		try:
-			while '(' in names:
-				pos1 = names.index('(')
-				pos2 = names.index(')', pos1 + 1)
-				if pos2 > pos1 + 1:
-					brack_data += [' '.join(names[pos1 + 1:pos2])]
-				del names[pos1:pos2 + 1]
-		except:
-			names = [s for s in names if s not in ['(', ')']]
-
-		s_pattn = ' ' + ' '.join(names) + ' '
-		res = self.db.iloc[[ii for ii, s in enumerate(self.addr_lst) if s_pattn in s], :]
-
-		# confine search by block number
-		if blk != None and len(res.index) > 1:
-			res1 = res[res.BLK_NO == blk]
-			res = res if res1.empty else res1
-
-		# confine search by names in brackets
-		while brack_data and len(res.index) > 1:
-			e = ' %s ' % brack_data.pop()
-			res1 = res[res.ADDRESS.str.contains(e)]
-			res = res if res1.empty else res1
-
-		return res.copy()
+		return self.search_names(QueryNormalizer(abbr, opt)(addrname))
+
+	def search_names(self, names):
+		names, blk, brack_data = split_query(names)
+
+		rows = self.lookup(names, blk)
+		if rows is None:
+			s_pattn = ' ' + ' '.join(names) + ' '
+			rows = np.array([ii for ii, s in enumerate(self.addr_lst) if s_pattn in s], dtype=np.int64)
+
+			# confine search by block number
+			if blk != None and len(rows) > 1:
+				rows1 = rows[self.blk_lst[rows] == blk]
+				rows = rows1 if len(rows1) else rows
+				stats.count('search.blk_confined' if len(rows1) else 'search.blk_unmatched')
+
+		# confine search by names in brackets, a building name by lookup, anything else by substring
+		while brack_data and len(rows) > 1:
+			e = brack_data.pop()
+			rows1 = rows[np.isin(rows, self.building_idx[e])] if e in self.building_idx else rows[:0]
+			if not len(rows1):
+				e = ' %s ' % e
+				rows1 = np.array([ii for ii in rows if e in self.addr_lst[ii]], dtype=np.int64)
+			rows = rows1 if len(rows1) else rows
+			stats.count('search.bracket_confined' if len(rows1) else 'search.bracket_unmatched')
+
+		return self.db.iloc[rows, :].copy()
 
 
 def compute_mean_geo(res):
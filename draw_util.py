@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 # Map-highlighter library, requires folium
 
-import folium, re, math
+import os, folium, re, math, itertools, matplotlib
+import multiprocessing as mp
 from matplotlib import colors
 from collections import *
 from dbsearch import *
 import pandas as pd
 from folium import plugins
 from folium_addons.heatmaps import *
+from folium_addons.circles import *
+from folium_addons.tiles import *
+from svy21 import wgs84_to_svy21, svy21_to_wgs84
 
 
 def drawElement(draw_data, map_obj):
@@ -41,17 +45,36 @@ addr_db = AddrDB('database.json.gz')
 nan = float('nan')
 
 
-def inferLatLon(df):
-	df = df.copy()
-	def addr2geo(addr):
+def geocode(addrs, cache=None):
+	# INPUT: an array of address names (string) or postal codes (int)
+	# OUTPUT: an (N, 2) array of [latitude, longitude], NaN if not found; every distinct address is searched only once
+	# cache: a dict of address => [latitude, longitude] shared between calls, e.g. across the layers of showHeatmaps()
+	codes, uniq = pd.factorize(pd.Series(addrs, dtype=object))
+	geo = np.full((len(uniq) + 1, 2), nan)  # code -1 (missing address) maps to the last row
+	n_cached = 0
+	for i, addr in enumerate(uniq):
+		if cache is not None and addr in cache:
+			geo[i] = cache[addr]
+			n_cached += 1
+			continue
 		try:
-			if not math.isnan(addr.latitude) and not math.isnan(addr.longitude):
-				return pd.Series([addr.latitude, addr.longitude])
-			addrs = addr_db[addr.address]
-			assert addrs
-			return pd.Series(compute_mean_geo(addrs))
+			res = addr_db.geo(addr)
+			if res is not None:
+				geo[i] = res
 		except:
-			return pd.Series([nan, nan])
+			pass
+		if cache is not None:
+			cache[addr] = geo[i].copy()
+	if stats.enabled:
+		stats.count('geocode.rows', len(codes))
+		stats.count('geocode.unique', len(uniq))
+		stats.count('geocode.cached', n_cached)
+		stats.count('geocode.not_found', int(np.isnan(geo[:-1, 0]).sum()))
+	return geo[codes]
+
+
+def inferLatLon(df, cache=None):
+	df = df.copy()
 
 	if 'count' not in df.columns:
 		df['count'] = 1
@@ -59,137 +82,199 @@ def inferLatLon(df):
 	if 'latitude' not in df.columns or 'longitude' not in df.columns:
 		df['latitude'] = df['longitude'] = nan
 
-	# fill in missing geo-coordinates
-	df[['latitude', 'longitude']] = df.apply(addr2geo, axis=1).rename(columns={0: 'latitude', 1: 'longitude'})
+	# fill in missing geo-coordinates, from SVY21 x/y if present, otherwise by geocoding the address
+	missing = (df['latitude'].isna() | df['longitude'].isna()).values
+	if missing.any() and 'x' in df.columns and 'y' in df.columns:
+		df.loc[missing, ['latitude', 'longitude']] = np.column_stack(svy21_to_wgs84(df['x'].values[missing], df['y'].values[missing]))
+		missing = (df['latitude'].isna() | df['longitude'].isna()).values
+	if missing.any() and 'address' in df.columns:
+		df.loc[missing, ['latitude', 'longitude']] = geocode(df['address'].values[missing], cache)
 	return df.dropna(how='any')
 
 
+def aggGeoCount(lat, lon, cnt, decimals=6):
+	# sum up counts at the same location, coordinates are rounded to 6 decimals (~0.1m) as in the database
+	df = pd.DataFrame({'latitude': np.round(lat, decimals), 'longitude': np.round(lon, decimals), 'count': cnt})
+	return df.dropna().groupby(['latitude', 'longitude'], sort=False)['count'].sum().reset_index()
+
+
+def chunkIter(obj):
+	# OUTPUT: (is_chunked, obj); a chunked input, i.e., pd.read_csv(..., chunksize=N) or any other iterable of DataFrames,
+	#         is returned as an iterator over its chunks, and any other input is returned as it is (an iterator as a list)
+	if isinstance(obj, (pd.DataFrame, dict, str, tuple)) or not hasattr(obj, '__iter__'):
+		return False, obj
+	it = iter(obj)
+	first = next(it, None)
+	rest = itertools.chain([] if first is None else [first], it)
+	if isinstance(first, pd.DataFrame):
+		return True, rest
+	return False, (obj if it is not obj else list(rest))
+
+
+def foldChunks(chunks, freq='1D', smooth=0, min_weight=0.25, timed=True):
+	# fold DataFrame chunks into running aggregates one chunk at a time, so that memory is bounded by the number of
+	# distinct (time frame, location) pairs rather than the number of rows
+	# timed: False => the time index of the chunks is ignored, e.g. for showCountmaps()
+	# OUTPUT: a HeatmapStore of the time-stamped chunks (see heatstore.py),
+	#         or pd.DataFrame(columns=['latitude', 'longitude', 'count']) of the counts summed per location otherwise
+	from heatstore import HeatmapStore
+	store, agg = None, None
+	for df in chunks:
+		stats.count('heatmap.chunks')
+		stats.count('heatmap.rows', len(df))
+		with stats.timer('heatmap.geocode'):
+			if timed and isinstance(df.index, pd.DatetimeIndex):
+				store = store or HeatmapStore(freq=freq, smooth=smooth, min_weight=min_weight)
+				store.add(df)
+				continue
+			df = inferLatLon(df)
+		part = aggGeoCount(df['latitude'].values, df['longitude'].values, df['count'].values)
+		agg = part if agg is None else aggGeoCount(*pd.concat([agg, part]).values.T)
+	if store is not None:
+		store.update_vmax()
+		return store
+	return agg
+
+
 def showCountmaps(obj, map_obj, radius_factor={}, add_args=[], stderr=None):
 	# obj = {'red':{'address1':count1, 'address2':count2}, '#00FF00':{...}}
 	# <address> can be: a) int => postal code; b) string => address-to-be-searched-for; c) [float,float] => direct [latitude, longitude]
 	global addr_db
 
-	draw_array = []
+	# add_args apply to every circle of a CircleCanvas layer; entries without a default value took a per-circle value in
+	# drawElement(), which the canvas layer has no place for, so they are dropped with a warning
+	layer_opts = {re.sub('[A-Z]', lambda t: '_' + t.group().lower(), aa[0]): aa[1] for aa in add_args if len(aa) > 1}
+	dropped = [aa[0] for aa in add_args if len(aa) < 2]
+	if dropped:
+		print('showCountmaps: add_args without a value are ignored: %s' % ', '.join(dropped), file=stderr or sys.stderr)
 	for color, addr2cnt in (obj.items() if hasattr(obj, 'items') else obj):
-		if isinstance(addr2cnt, pd.DataFrame):
-			df = inferLatLon(addr2cnt)
-			addr2cnt = [[(lat,lon),cnt] for lat,lon,cnt in df[['latitude', 'longitude', 'count']].values.tolist()]
+		chunked, addr2cnt = chunkIter(addr2cnt)
+		if chunked or isinstance(addr2cnt, pd.DataFrame):
+			df = foldChunks(addr2cnt, timed=False) if chunked else inferLatLon(addr2cnt)
+			geo, cnt = df[['latitude', 'longitude']].values, df['count'].values
+		else:
+			items = list(addr2cnt.items() if type(addr2cnt) == dict else addr2cnt)
+			addrs, cnt = [addr for addr, _ in items], [c for _, c in items]
+			is_name = np.array([type(addr) in [int, str] for addr in addrs], dtype=bool)
+			is_geo = np.array([type(addr) in [list, tuple] and len(addr) == 2 for addr in addrs], dtype=bool)
+			geo = np.full((len(addrs), 2), nan)
+			if is_geo.any():
+				geo[is_geo] = [addr for addr, b in zip(addrs, is_geo) if b]
+			if is_name.any():
+				geo[is_name] = geocode([addr for addr, b in zip(addrs, is_name) if b])
+				if stderr != None:
+					for addr in np.array(addrs, dtype=object)[is_name & np.isnan(geo[:, 0])]:
+						print('Address not found: %s' % addr, file=stderr)
 
 		colorRGB = color if color.startswith('#') else colors.cnames[color]
-		geo2cnt = defaultdict(lambda: 0)
-		for addr, cnt in (addr2cnt.items() if type(addr2cnt) == dict else addr2cnt):
-			if type(addr) in [int, str]:
-				addrs = addr_db[addr]
-				if not addrs:
-					if stderr != None:
-						print('Address not found: %s' % addr, file=stderr)
-					continue
-				geo = compute_mean_geo(addrs)
-				geo2cnt[tuple(geo)] += cnt
-			elif type(addr) in [list, tuple] and len(addr) == 2:
-				geo2cnt[tuple(addr)] += cnt
+		df = aggGeoCount(geo[:, 0], geo[:, 1], np.asarray(cnt, dtype=float))
 
 		# total area of all circles add up to half of Singapore area
 		rf = radius_factor.get(color, 1) if isinstance(radius_factor, dict) else radius_factor
-		radius_mul = (721500000 / 2 / sum(geo2cnt.values()) / np.pi) ** 0.5 * rf if geo2cnt else 1
+		total = df['count'].sum()
+		radius_mul = (721500000 / 2 / total / np.pi) ** 0.5 * rf if total > 0 else 1
 
-		draw_dct = {'func': 'Circle', 'n_fix_args': 1, 'add_args': [['radius'], ['color', colorRGB], *add_args],
-		            'obj_list': [[list(geo), (cnt ** 0.5) * radius_mul] for geo, cnt in geo2cnt.items()]}
+		# all circles of one color are drawn by a single canvas layer
+		cnt = df['count'].values
+		data = np.column_stack([df['latitude'].values, df['longitude'].values, np.sqrt(cnt) * radius_mul, cnt])
+		CircleCanvas(data, name=color, **{'color': colorRGB, **layer_opts}).add_to(map_obj)
 
-		draw_array += [draw_dct]
+	return map_obj
 
-	drawElements(draw_array, map_obj)
 
-	return map_obj
+def agg_count_set_dt(df_in, dt):
+	df = df_in.groupby(['latitude', 'longitude']).sum()
+	df['datetime'] = dt
+	return df.reset_index().set_index('datetime')
 
 
-def showHeatmaps(obj, map_obj, freq='1D', smooth=0, min_weight=0.25, add_options={}):
+def norm_count(df, min_weight=0.25, vmax=None):
+	# map counts linearly onto [min_weight, 1], <vmax> defaults to the maximum count in <df>
+	try:
+		vmax = df['count'].max() if vmax is None else vmax
+		vdiffi = (1 - min_weight) / vmax
+		df['count'] = df['count'] * vdiffi + min_weight
+	except:
+		df['count'] = 1
+	return df
+
+
+def smooth_heatmap(df, freq, N=0, clip=None):
+	# For N>0: count at every time index will spread to adjacent N indices, i.e., N=2, [0,0,1,0,0] => [.25, .5, 1, .5, .25]
+	# For N<0: extra abs(N) intermediate time slices will created for linear interpolation, i.e., N=-2, [10,20,30] => [10, 13.33,16.67, 20, 23.33,26.67, 30]
+	# clip: the (start, end) time range to keep, defaults to the time range of <df>
+	smooth = abs(N)
+	dfs = [df]
+	freq = pd.to_timedelta(freq)
+	if N > 0:
+		for i in range(1, smooth + 1):
+			dfC = df.copy()
+			dfC['count'] *= 2 ** (-i)
+			dfC.index = df.index + freq * i
+			dfs += [dfC.copy()]
+			dfC.index = df.index - freq * i
+			dfs += [dfC]
+	elif N < 0:
+		for i in range(smooth):
+			dfC = df.copy()
+			f = (i+1)/(smooth+1)
+			dfC['count'] *= f
+			dfC.index = df.index + freq * f
+			dfs += [dfC.copy()]
+			dfC.index = df.index - freq * f
+			dfs += [dfC]
+		freq /= (smooth+1)
+	df = pd.concat(dfs).sort_index()[slice(*clip) if clip else slice(df.index.min(), df.index.max())]
+	return df, freq
+
+
+def bin_heatmap(df, freq, smooth=0):
+	# INPUT: time-indexed pd.DataFrame(columns=['latitude', 'longitude', 'count'])
+	# OUTPUT: counts summed per location and per (smoothed) time frame, and the frame frequency
+	with stats.timer('heatmap.smooth'):
+		df, freq = smooth_heatmap(df, freq, smooth)
+	with stats.timer('heatmap.bin'):
+		df = pd.concat([agg_count_set_dt(df1, dt) for dt, df1 in df.groupby(pd.Grouper(freq=freq))])
+	return df, freq
+
+
+def split_frames(df, freq):
+	# OUTPUT: the list of frame times and the list of [latitude, longitude, count] arrays of every frame
+	time_list, data_list = list(zip(*[[dt, df1.values] for dt, df1 in df.groupby(pd.Grouper(freq=freq))]))
+	return list(time_list), list(data_list)
+
+
+def showHeatmaps(obj, map_obj, freq='1D', smooth=0, min_weight=0.25, add_options={}, pyramid=False, n_jobs=1):
 	# INPUT obj = [[color, DataFrame], ...] or {color:DataFrame} or {(color, name):DataFrame}
 	# static heatmap:       pd.DataFrame(columns=['address', 'count', duration=pd.Timedelta], index=range())
 	# time-stamped heatmap: pd.DataFrame(columns=['address', 'count', duration=pd.Timedelta], index=pd.DatetimeIndex)
 	# direct geo-coordinates: pd.DataFrame(columns=['latitude', 'longitude', 'count', pd.Timedelta], index=pd.DatetimeIndex)
+	# SVY21 coordinates: pd.DataFrame(columns=['x', 'y', 'count', pd.Timedelta], index=pd.DatetimeIndex)
 	# 'count' and 'duration' column are optional; 0 duration means one period, i.e., '1D' if freq=='D'
+	# chunked input: pd.read_csv(..., chunksize=N) or any iterable of the above DataFrames, folded one chunk at a time
 	# color: 'red', '#FF0000', None => full color-spectrum heatmap
+	# pyramid: True or a dict of HeatMapPyramid options => static heatmaps swap pre-aggregated levels of detail by zoom
+	# n_jobs: the number of worker processes building the layers, see heatmapLayers(); 1 => all in this process, None => one per CPU
 
-	def agg_count_set_dt(df_in, dt):
-		df = df_in.groupby(['latitude', 'longitude']).sum()
-		df['datetime'] = dt
-		return df.reset_index().set_index('datetime')
-
-	def norm_count(df, min_weight=0.25):
-		try:
-			vmax = df['count'].max()
-			vdiffi = (1 - min_weight) / vmax
-			df['count'] = df['count'].apply(lambda v: v * vdiffi + min_weight)
-		except:
-			df['count'] = 1
-		return df
-
-	def smooth_heatmap(df, freq, N=0):
-		# For N>0: count at every time index will spread to adjacent N indices, i.e., N=2, [0,0,1,0,0] => [.25, .5, 1, .5, .25]
-		# For N<0: extra abs(N) intermediate time slices will created for linear interpolation, i.e., N=-2, [10,20,30] => [10, 13.33,16.67, 20, 23.33,26.67, 30]
-		smooth = abs(N)
-		dfs = [df]
-		freq = pd.to_timedelta(freq)
-		if N > 0:
-			for i in range(1, smooth + 1):
-				dfC = df.copy()
-				dfC['count'] *= 2 ** (-i)
-				dfC.index = df.index + freq * i
-				dfs += [dfC.copy()]
-				dfC.index = df.index - freq * i
-				dfs += [dfC]
-		elif N < 0:
-			for i in range(smooth):
-				dfC = df.copy()
-				f = (i+1)/(smooth+1)
-				dfC['count'] *= f
-				dfC.index = df.index + freq * f
-				dfs += [dfC.copy()]
-				dfC.index = df.index - freq * f
-				dfs += [dfC]
-			freq /= (smooth+1)
-		df = pd.concat(dfs).sort_index()[df.index.min():df.index.max()]
-		return df, freq
-
+	layers = list(obj.items() if hasattr(obj, 'items') else obj)
 	isFirstTimedHeatmap = True
-	for color, df_raw in (obj.items() if hasattr(obj, 'items') else obj):
-		df = df_raw.copy()
-		isTimeStamped = isinstance(df.index, pd.DatetimeIndex)
-
-		if 'duration' not in df.columns and isTimeStamped:
-			df['duration'] = pd.to_timedelta(0)
-
-		df = inferLatLon(df)
-
-		# extract name and color if color is a tuple
-		options = {'min_opacity': 0, 'max_opacity': 1, **add_options}
-		color, options['name'] = color if type(color) in [tuple, list] and len(color) == 2 else (color, color)
-
-		# convert color
-		try:
-			colorRGB = color if color.startswith('#') else colors.cnames[color]
-			options['gradient'] = {1: colorRGB}
-		except:
-			pass
+	for (color, _), (time_list, data_list, data_json, bounds) in zip(layers, heatmapLayers([df for _, df in layers], freq, smooth, min_weight, n_jobs)):
+		options, color = heatmapOptions(color, add_options)
 
 		# create heatmap
-		df = df[['latitude', 'longitude', 'count']]
-		if isTimeStamped:
-			df, freq = smooth_heatmap(df, freq, smooth)
-			df = pd.concat([agg_count_set_dt(df1, dt) for dt, df1 in df.groupby(pd.Grouper(freq=freq))])
-			df = norm_count(df, min_weight)
-			time_list, data_list = list(zip(*[[dt, df1.values.tolist()] for dt, df1 in df.groupby(pd.Grouper(freq=freq))]))
+		if time_list is not None:
 			if isFirstTimedHeatmap:
 				isFirstTimedHeatmap = False
-				heatmap = HeatMapWithTime(list(data_list), index=[str(i) for i in time_list], **options)
+				heatmap = HeatMapWithTime(data_list, index=[str(i) for i in time_list], data_json=data_json, bounds=bounds, **options)
 			else:
-				heatmap = HeatMapWithTimeAdditional(list(data_list), **options)
+				heatmap = HeatMapWithTimeAdditional(data_list, data_json=data_json, bounds=bounds, **options)
 		else:
-			data_list = norm_count(df, min_weight).values.tolist()
 			if 'radius' in options:
 				options['radius'] = options['blur'] = options['radius']*2/3
-			heatmap = HeatMap(data_list, radius=11, blur=8, **options)
+			if pyramid:
+				heatmap = HeatMapPyramid(data_list, **{'radius': 11, 'blur': 8, **(pyramid if isinstance(pyramid, dict) else {}), **options})
+			else:
+				heatmap = HeatMap(data_list, **{'radius': 11, 'blur': 8, **options})
 
 		heatmap.add_to(map_obj)
 
@@ -198,10 +283,161 @@ def showHeatmaps(obj, map_obj, freq='1D', smooth=0, min_weight=0.25, add_options
 	return map_obj
 
 
+def heatmapData(df_raw, freq='1D', smooth=0, min_weight=0.25, cache=None):
+	# geocode, bin and normalize one layer of showHeatmaps() input, <cache> as in geocode()
+	# OUTPUT: (time_list, data_list) of the frames for time-stamped input, (None, [latitude, longitude, weight] array) otherwise
+	chunked, df_raw = chunkIter(df_raw)
+	if chunked:
+		# time-stamped chunks are folded into a HeatmapStore, which yields the binned and normalized frames
+		df = store = foldChunks(df_raw, freq, smooth, min_weight)
+		isTimeStamped = not isinstance(store, pd.DataFrame)
+	else:
+		isTimeStamped = isinstance(df_raw.index, pd.DatetimeIndex)
+		with stats.timer('heatmap.geocode'):
+			df = inferLatLon(df_raw, cache)
+		stats.count('heatmap.rows', len(df))
+	stats.count('heatmap.layers')
+
+	if isTimeStamped and chunked:
+		with stats.timer('heatmap.frames'):
+			return store.frames()
+	if isTimeStamped:
+		df, frame_freq = bin_heatmap(df[['latitude', 'longitude', 'count']], freq, smooth)
+		with stats.timer('heatmap.normalize'):
+			df = norm_count(df, min_weight)
+		with stats.timer('heatmap.split'):
+			return split_frames(df, frame_freq)
+	with stats.timer('heatmap.normalize'):
+		return None, norm_count(df[['latitude', 'longitude', 'count']], min_weight).values
+
+
+def heatmapLayer(args):
+	# worker of heatmapLayers(): heatmapData() of one geocoded layer; the frames of a time-stamped layer are sent back
+	# only as their JSON, with their bounds
+	# OUTPUT: ((time_list, data_list, data_json, bounds), the worker's stats snapshot)
+	stats.reset()
+	time_list, data_list = heatmapData(*args)
+	if time_list is None:
+		return (None, data_list, None, None), stats.snapshot()
+	with stats.timer('heatmap.serialize'):
+		layer = HeatMapWithTimeAdditional(data_list)
+		data_json, bounds = layer.data_json(), layer.get_bounds()
+	return (time_list, None, data_json, bounds), stats.snapshot()
+
+
+def heatmapLayers(dfs, freq='1D', smooth=0, min_weight=0.25, n_jobs=1):
+	# heatmapData() of all layers of showHeatmaps(): the in-memory layers are geocoded here with a shared cache, so that
+	# addresses common to several layers are searched only once, then binned, normalized and serialized in a pool of
+	# <n_jobs> worker processes if n_jobs != 1 (None: one per layer up to the number of CPUs); chunked layers are folded here
+	# OUTPUT: [(time_list, data_list, data_json, bounds), ...] in the order of <dfs>; layers built by a worker come with
+	#         data_json and the bounds of their frames instead of data_list, the others with data_list only
+	cache, todo, out = {}, [], [None] * len(dfs)
+	for i, df in enumerate(dfs):
+		chunked, df = chunkIter(df)
+		if chunked:
+			out[i] = heatmapData(df, freq, smooth, min_weight) + (None, None)
+			continue
+		with stats.timer('heatmap.geocode'):
+			todo += [(i, inferLatLon(df, cache))]
+
+	n_jobs = min(n_jobs or os.cpu_count() or 1, len(todo))
+	args = [(df, freq, smooth, min_weight) for _, df in todo]
+	if n_jobs > 1 and not mp.current_process().daemon:
+		# fork shares the loaded address database with the workers; elsewhere the workers import this module afresh
+		ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+		with ctx.Pool(n_jobs) as pool:
+			results = pool.map(heatmapLayer, args)
+		for _, worker_stats in results:
+			stats.merge(worker_stats)
+		results = [res for res, _ in results]
+	else:
+		results = [heatmapData(*a) + (None, None) for a in args]
+	for (i, _), res in zip(todo, results):
+		out[i] = res
+	return out
+
+
+def heatmapOptions(color, add_options={}):
+	# OUTPUT: (layer options, color) of a showHeatmaps() layer key: color, or (color, name)
+	options = {'min_opacity': 0, 'max_opacity': 1, **add_options}
+	color, options['name'] = color if type(color) in [tuple, list] and len(color) == 2 else (color, color)
+
+	# convert color
+	try:
+		colorRGB = color if color.startswith('#') else colors.cnames[color]
+		options['gradient'] = {1: colorRGB}
+	except:
+		pass
+	return options, color
+
+
+def showHeatTiles(obj, map_obj, out_dir, url=None, zooms=range(10, 16), freq='1D', smooth=0, min_weight=0.25, add_options={}):
+	# same input as showHeatmaps(), but every layer is rasterized offline into PNG tiles (see rasterheat.py) under
+	# out_dir/layer<i>/, and added to the map as a tile layer, so that the HTML holds no data points at all
+	# url: the URL of out_dir as seen from the HTML page, defaults to out_dir
+	# zooms: the zoom levels to render, the tiles of the nearest rendered zoom are scaled at other zoom levels
+	# add_options: radius and blur in pixels (default 11 and 8), and TileLayer/TileFramesWithTime options
+	from rasterheat import HeatTileRenderer
+	url = (out_dir if url is None else url).rstrip('/')
+	zooms = list(zooms)
+	isFirstTimedHeatmap = True
+	for i, (color, df_raw) in enumerate(obj.items() if hasattr(obj, 'items') else obj):
+		time_list, data_list = heatmapData(df_raw, freq, smooth, min_weight)
+		options, color = heatmapOptions(color, add_options)
+		renderer = HeatTileRenderer(options.pop('radius', 11), options.pop('blur', 8), options.pop('gradient', None))
+		for k in ['min_opacity', 'max_opacity']:
+			options.pop(k)
+		tile_opts = {'min_native_zoom': min(zooms), 'max_native_zoom': max(zooms), 'attr': ' ', **options}
+
+		with stats.timer('heatmap.rasterize'):
+			if time_list is not None:
+				renderer.render_frames(data_list, os.path.join(out_dir, 'layer%d' % i), zooms, index=[str(t) for t in time_list])
+				heatmap = TileFramesWithTime('%s/layer%d/{t}/{z}/{x}/{y}.png' % (url, i), [str(t) for t in time_list],
+				                             additional=not isFirstTimedHeatmap, **tile_opts)
+				isFirstTimedHeatmap = False
+			else:
+				renderer.render(data_list, os.path.join(out_dir, 'layer%d' % i), zooms)
+				heatmap = folium.TileLayer('%s/layer%d/{z}/{x}/{y}.png' % (url, i), overlay=True, **tile_opts)
+
+		heatmap.add_to(map_obj)
+
+	folium.LayerControl().add_to(map_obj)
+
+	return map_obj
+
+
+def showChoropleth(regions, df, map_obj, name='count', cmap='YlOrRd', fill_opacity=0.7, add_options={}):
+	# INPUT regions: regions.Regions, or a GeoJSON file name/dict of polygons
+	# df: pd.DataFrame(columns=['address' or 'latitude'+'longitude', 'count']) as in showHeatmaps()
+	# every region is filled by its total count on the matplotlib colormap <cmap>; regions without any count are left unfilled
+	# OUTPUT: the per-region counts, pd.DataFrame(columns=['region', 'count'])
+	import branca.colormap
+	from regions import Regions
+	if not isinstance(regions, Regions):
+		regions = Regions(regions)
+
+	with stats.timer('heatmap.geocode'):
+		df = inferLatLon(df)
+	with stats.timer('choropleth.assign'):
+		cnt = regions.count(df['latitude'].values, df['longitude'].values, df['count'].values)
+
+	vmax = cnt.max() if len(cnt) and cnt.max() > 0 else 1
+	cm = matplotlib.colormaps[cmap]
+	fill = [colors.to_hex(cm(v / vmax)) if v > 0 else None for v in cnt]
+	style = {'color': '#555555', 'weight': 1, 'fillOpacity': fill_opacity, **add_options}
+	folium.GeoJson(regions.to_geojson(count=cnt, fill=fill), name=name,
+	               style_function=lambda f: {**style, 'fillColor': f['properties']['fill'] or '#000000',
+	                                         'fillOpacity': style['fillOpacity'] if f['properties']['fill'] else 0},
+	               tooltip=folium.GeoJsonTooltip(fields=['name', 'count'], aliases=['region', name])).add_to(map_obj)
+	branca.colormap.LinearColormap([colors.to_hex(cm(v)) for v in np.linspace(0, 1, 9)], vmin=0, vmax=vmax, caption=name).add_to(map_obj)
+
+	return pd.DataFrame({'region': regions.names, 'count': cnt})
+
+
 def addr2geo(arr):
 	# INPUT: a list of string (address name) or int (postal code)
 	# OUTPUT: a dict of input address to geo-coordinates (latitude, longitude)
-	ret = {addr: compute_mean_geo(res) for addr in set(arr) for res in [addr_db[addr]] if res}
+	ret = {addr: list(res) for addr in set(arr) for res in [addr_db.geo(addr)] if res is not None}
 	return ret
 
 
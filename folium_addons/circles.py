@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import json
+import numpy as np
+
+from branca.element import Figure, JavascriptLink
+from folium.map import Layer
+from folium.utilities import (
+    parse_options,
+    if_pandas_df_convert_to_numpy,
+)
+
+from jinja2 import Template
+
+from folium_addons.heatmaps import _default_prefix, _points_bounds, _json_slot, _render_apart
+
+
+_default_js2 = [
+    ('leaflet-circles.js',
+     _default_prefix+'leaflet_circles.js'),
+    ]
+
+
+class CircleCanvas(Layer):
+	"""
+	Create a layer of circles which are shipped as one packed array and drawn
+	onto a single canvas, instead of one folium.Circle (and one SVG node) per
+	circle. Clicking on a circle opens a popup with its count.
+
+	Parameters
+	----------
+	data : list of circles of the form [lat, lng, radius] or [lat, lng, radius, count]
+		Radius is in metres. You can also provide a numpy.array of shape (n,3) or (n,4).
+	name : string, default None
+		The name of the Layer, as it will appear in LayerControls.
+	color : string, default '#3388ff'
+		Stroke color.
+	weight : int, default 3
+		Stroke width in pixels.
+	opacity : float or string, default 1
+		Stroke opacity, e.g. 0.5 or '50%'.
+	fill : bool, default True
+		Whether to fill the circles.
+	fill_color : string, default None
+		Fill color, same as `color` if not specified.
+	fill_opacity : float or string, default 0.2
+		Fill opacity, e.g. 0.1 or '10%'.
+	popup : bool, default True
+		Whether to show the count of the clicked circle in a popup.
+	overlay : bool, default True
+		Adds the layer as an optional overlay (True) or the base layer (False).
+	control : bool, default True
+		Whether the Layer will be included in LayerControls.
+	show: bool, default True
+		Whether the layer will be shown on opening (only for overlays).
+	"""
+	_template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.circleCanvas(
+                {{ this.data_json() }},
+                {{ this.options|tojson }}
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+	def __init__(self, data, name=None, color='#3388ff', weight=3, opacity=1,
+	             fill=True, fill_color=None, fill_opacity=0.2, popup=True,
+	             overlay=True, control=True, show=True, **kwargs):
+		super(CircleCanvas, self).__init__(name=name, overlay=overlay,
+		                                   control=control, show=show)
+		self._name = 'CircleCanvas'
+		data = np.asarray(if_pandas_df_convert_to_numpy(data), dtype=float)
+		data = data.reshape(0, 4) if data.size == 0 else data
+		if data.ndim != 2 or data.shape[1] not in (3, 4):
+			raise ValueError('data must be a list of [lat, lng, radius] or [lat, lng, radius, count] circles.')
+		if np.isnan(data[:, :3]).any():
+			raise ValueError('data may not contain NaNs.')
+		if data.shape[1] == 3:
+			data = np.column_stack([data, np.full(len(data), np.nan)])
+		self.data = data
+		self.options = parse_options(
+			color=color,
+			weight=weight,
+			opacity=opacity,
+			fill=fill,
+			fill_color=fill_color,
+			fill_opacity=fill_opacity,
+			popup=popup,
+			**kwargs
+		)
+
+	def data_json(self):
+		# packed as [lat0, lng0, radius0, count0, lat1, ...], missing counts are emitted as NaN
+		return _json_slot(self, lambda: json.dumps(self.data.ravel().tolist()))
+
+	def render(self, **kwargs):
+		_render_apart(self, super(CircleCanvas, self).render, **kwargs)
+
+		figure = self.get_root()
+		assert isinstance(figure, Figure), ('You cannot render this Element '
+		                                    'if it is not in a Figure.')
+
+		# Import Javascripts
+		for name, url in _default_js2:
+			figure.header.add_child(JavascriptLink(url), name=name)
+
+	def _get_self_bounds(self):
+		"""
+		Computes the bounds of the object itself (not including it's children)
+		in the form [[lat_min, lon_min], [lat_max, lon_max]].
+
+		"""
+		return _points_bounds(self.data)
@@ -1,20 +1,19 @@
 # -*- coding: utf-8 -*-
 
-import warnings
+import json, warnings
 import numpy as np
 
 from branca.element import CssLink, Element, Figure, JavascriptLink
 from folium.map import Layer
 from folium.utilities import (
-    none_max,
-    none_min,
     parse_options,
     if_pandas_df_convert_to_numpy,
-    validate_location,
 )
 
 from jinja2 import Template
 
+from telemetry import stats
+
 
 _default_prefix = './folium_addons/'
 _default_js1 = [
@@ -23,6 +22,78 @@ _default_js1 = [
     ]
 
 
+def _as_points(data):
+	"""
+	Converts a list/DataFrame/array of [lat, lng] or [lat, lng, weight] points
+	into a float numpy.array of shape (n, 2) or (n, 3).
+	"""
+	data = np.asarray(if_pandas_df_convert_to_numpy(data), dtype=float)
+	if data.size == 0:
+		return data.reshape(0, 3)
+	if data.ndim != 2 or data.shape[1] < 2:
+		raise ValueError('data must be a list of [lat, lng] or [lat, lng, weight] points.')
+	if np.isnan(data).any():
+		raise ValueError('data may not contain NaNs.')
+	return data
+
+
+def _points_bounds(points):
+	"""
+	Computes [[lat_min, lon_min], [lat_max, lon_max]] of a points array, or
+	[[None, None], [None, None]] if it is empty.
+	"""
+	if not len(points):
+		return [[None, None], [None, None]]
+	lo, hi = points[:, :2].min(axis=0), points[:, :2].max(axis=0)
+	return [[float(lo[0]), float(lo[1])], [float(hi[0]), float(hi[1])]]
+
+
+def _frames_bounds(frames):
+	frames = [f for f in frames if len(f)]
+	return _points_bounds(np.concatenate(frames) if frames else np.empty((0, 3)))
+
+
+def _frames_to_json(frames):
+	return json.dumps([f.tolist() for f in frames])
+
+
+class _RenderedScript(Element):
+	"""
+	An already rendered script, output as it is.
+	"""
+	def __init__(self, script):
+		super(_RenderedScript, self).__init__()
+		self.script = script
+
+	def render(self, **kwargs):
+		return self.script
+
+
+def _json_slot(layer, to_json):
+	"""
+	Returns the JSON of the data of a layer, to_json(), to print in its
+	template, or a placeholder in the first pass of _render_apart().
+	"""
+	return 'null' if getattr(layer, '_data_apart', False) else to_json()
+
+
+def _render_apart(layer, render, **kwargs):
+	"""
+	Calls render() of a layer whose template prints its data through
+	_json_slot(). branca compiles the script of a layer as a Jinja template,
+	which for large layers takes longer than serializing the data, so render()
+	is run with placeholders only, and its script is then replaced by the
+	output of the layer's script macro with the data, as it is.
+	"""
+	layer._data_apart = True
+	try:
+		render(**kwargs)
+	finally:
+		layer._data_apart = False
+	script = layer._template.module.script(layer, kwargs)
+	layer.get_root().script.add_child(_RenderedScript(script), name=layer.get_name())
+
+
 class HeatMap(Layer):
 	"""
 	Create a Heatmap layer
@@ -55,7 +126,7 @@ class HeatMap(Layer):
 	_template = Template(u"""
         {% macro script(this, kwargs) %}
             var {{ this.get_name() }} = L.heatLayer(
-                {{ this.data|tojson }},
+                {{ this.data_json() }},
                 {{ this.options|tojson }}
             ).addTo({{ this._parent.get_name() }});
         {% endmacro %}
@@ -67,11 +138,7 @@ class HeatMap(Layer):
 		super(HeatMap, self).__init__(name=name, overlay=overlay,
 		                              control=control, show=show)
 		self._name = 'HeatMap'
-		data = if_pandas_df_convert_to_numpy(data)
-		self.data = [[*validate_location(line[:2]), *line[2:]]  # noqa: E999
-		             for line in data]
-		if np.any(np.isnan(self.data)):
-			raise ValueError('data may not contain NaNs.')
+		self.data = _as_points(data)
 		if kwargs.pop('max_val', None):
 			warnings.warn('The `max_val` parameter is no longer necessary. '
 			              'The largest intensity is calculated automatically.',
@@ -85,8 +152,12 @@ class HeatMap(Layer):
 			**kwargs
 		)
 
+	def data_json(self):
+		return _json_slot(self, lambda: json.dumps(self.data.tolist()))
+
 	def render(self, **kwargs):
-		super(HeatMap, self).render(**kwargs)
+		with stats.timer('heatmap.serialize'):
+			_render_apart(self, super(HeatMap, self).render, **kwargs)
 
 		figure = self.get_root()
 		assert isinstance(figure, Figure), ('You cannot render this Element '
@@ -102,20 +173,102 @@ class HeatMap(Layer):
 		in the form [[lat_min, lon_min], [lat_max, lon_max]].
 
 		"""
+		return _points_bounds(self.data)
 
-		bounds = [[None, None], [None, None]]
-		for point in self.data:
-			bounds = [
-				[
-					none_min(bounds[0][0], point[0]),
-					none_min(bounds[0][1], point[1]),
-				],
-				[
-					none_max(bounds[1][0], point[0]),
-					none_max(bounds[1][1], point[1]),
-				],
-			]
-		return bounds
+
+def _grid_aggregate(points, cell):
+	"""
+	Merges the [lat, lng, weight] points falling into the same cell of a
+	`cell`-degree grid into one point at their weighted mean position with
+	their summed weight, the same way leaflet-heat merges points on screen.
+	"""
+	if not len(points):
+		return points
+	w = points[:, 2] if points.shape[1] > 2 else np.ones(len(points))
+	ij = np.floor(points[:, :2] / cell).astype(np.int64)
+	key = (ij[:, 0] - ij[:, 0].min()) * (ij[:, 1].max() - ij[:, 1].min() + 1) + (ij[:, 1] - ij[:, 1].min())
+	_, inv = np.unique(key, return_inverse=True)
+	sw, n = np.bincount(inv, w), np.bincount(inv)
+	denom = np.where(sw > 0, sw, n)
+	w_pos = np.where(sw[inv] > 0, w, 1)
+	lat = np.bincount(inv, points[:, 0] * w_pos) / denom
+	lng = np.bincount(inv, points[:, 1] * w_pos) / denom
+	return np.column_stack([lat, lng, sw])
+
+
+class HeatMapPyramid(HeatMap):
+	"""
+	Create a Heatmap layer which swaps between pre-aggregated levels of detail
+	according to the map's current zoom. At zoom z, points are merged on a grid
+	of `cell_px` screen pixels, so the browser renders at most
+	(view_width/cell_px)*(view_height/cell_px) points per view; beyond
+	`max_level_zoom` the original points are shown, those at the same
+	coordinates merged. A level is only kept if it has at most a quarter of
+	the points of the next finer one, so that all levels together are at
+	most 4/3 of the original points.
+
+	Parameters
+	----------
+	data : list of points of the form [lat, lng] or [lat, lng, weight]
+		The points you want to plot.
+		You can also provide a numpy.array of shape (n,2) or (n,3).
+	min_level_zoom : int, default 10
+		The coarsest aggregation level, also used for all zooms below it.
+	max_level_zoom : int, default 16
+		The finest aggregation level, full detail is shown beyond it.
+	cell_px : float, default None
+		Grid cell size in screen pixels, (radius+blur)/2 by default, which is
+		the cell size leaflet-heat merges points on.
+	**kwargs
+		Other HeatMap arguments (name, radius, blur, gradient, etc.)
+	"""
+	_template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.heatLayer([], {{ this.options|tojson }});
+            {{ this.get_name() }}.on('add', function(e){
+                var layer = e.target, map = layer._map, current = -1;
+                if(layer._levels) return;
+                layer._levels = {{ this.levels_json() }};
+                layer._zooms = {{ this.zooms|tojson }};
+                function update(){
+                    var z = map.getZoom(), i = 0;
+                    while(i+1 < layer._zooms.length && layer._zooms[i+1] <= z) ++i;
+                    if(i != current){
+                        current = i;
+                        layer.setLatLngs(layer._levels[i]);
+                    }
+                }
+                map.on('zoomend', update);
+                update();
+            });
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+	def __init__(self, data, min_level_zoom=10, max_level_zoom=16, cell_px=None,
+	             radius=25, blur=15, **kwargs):
+		super(HeatMapPyramid, self).__init__(data, radius=radius, blur=blur, **kwargs)
+		self._name = 'HeatMapPyramid'
+		cell_px = cell_px or (radius + blur) / 2
+
+		# from fine to coarse, each level is aggregated from the previous finer one; the finest level only merges the
+		# points at the same coordinates, and a coarser level is kept only if it has at most a quarter of the points of
+		# the previous one, otherwise that one is used down to zoom z, so that all levels together stay under 4/3 of the
+		# points of the finest
+		zooms, levels = [max_level_zoom + 1], [_grid_aggregate(self.data, 1e-7)]
+		for z in range(max_level_zoom, min_level_zoom - 1, -1):
+			level = _grid_aggregate(levels[-1], cell_px * 360 / (256 * 2 ** z))
+			if len(level) > len(levels[-1]) / 4:
+				zooms[-1] = z
+				continue
+			zooms += [z]
+			levels += [level]
+		zooms[-1] = 0
+		# merged positions and weights are rounded to 6 decimals (~0.1m) as in the input, to keep the JSON short
+		self.zooms, self.levels = zooms[::-1], [np.round(level, 6) for level in levels[::-1]]
+
+	def levels_json(self):
+		return _json_slot(self, lambda: _frames_to_json(self.levels))
 
 
 _default_js = [
@@ -127,6 +280,8 @@ _default_js = [
 	 _default_prefix+'pa7_hm.min.js'),
 	('leaflet-heatmap.js',
 	 _default_prefix+'pa7_leaflet_hm.min.js'),
+	('leaflet-td-heatmap.js',
+	 _default_prefix+'leaflet_td_heatmap.js'),
 ]
 
 _default_css = [
@@ -138,7 +293,7 @@ _default_css = [
 class HeatMapWithTimeAdditional(Layer):
 	_template = Template("""
         {% macro script(this, kwargs) %}
-            var {{this.get_name()}} = new TDHeatmap({{ this.data }},
+            var {{this.get_name()}} = new TDHeatmap({{ this.data_json() }},
                 {heatmapOptions: {
                     radius: {{this.radius}},
                     minOpacity: {{this.min_opacity}},
@@ -155,12 +310,13 @@ class HeatMapWithTimeAdditional(Layer):
 	def __init__(self, data, name=None, radius=15,
 	             min_opacity=0, max_opacity=0.6,
 	             scale_radius=False, gradient=None, use_local_extrema=False,
-	             overlay=True, control=True, show=True):
+	             overlay=True, control=True, show=True, data_json=None, bounds=None):
 		super(HeatMapWithTimeAdditional, self).__init__(
 			name=name, overlay=overlay, control=control, show=show
 		)
 		self._name = 'HeatMap'
-		self.data = data
+		self.data = None if data is None else [_as_points(frame) for frame in data]
+		self._data_json, self._bounds = data_json, bounds
 
 		# Heatmap settings.
 		self.radius = radius
@@ -170,6 +326,20 @@ class HeatMapWithTimeAdditional(Layer):
 		self.use_local_extrema = 'true' if use_local_extrema else 'false'
 		self.gradient = gradient
 
+	def data_json(self):
+		return _json_slot(self, lambda: _frames_to_json(self.data) if self._data_json is None else self._data_json)
+
+	def render(self, **kwargs):
+		with stats.timer('heatmap.serialize'):
+			_render_apart(self, super(HeatMapWithTimeAdditional, self).render, **kwargs)
+
+	def _get_self_bounds(self):
+		"""
+		Computes the bounds of the object itself (not including it's children)
+		over all time frames in the form [[lat_min, lon_min], [lat_max, lon_max]].
+		"""
+		return self._bounds if self.data is None else _frames_bounds(self.data)
+
 
 class HeatMapWithTime(Layer):
 	"""
@@ -219,6 +389,12 @@ class HeatMapWithTime(Layer):
 		Whether the Layer will be included in LayerControls.
 	show: bool, default True
 		Whether the layer will be shown on opening (only for overlays).
+	data_json: string, default None
+		The JSON of data if already serialized, e.g. by a worker process;
+		data may then be None, with index given.
+	bounds: default None
+		The bounds [[lat_min, lon_min], [lat_max, lon_max]] of data_json if
+		data is None.
 
 	"""
 	_template = Template(u"""
@@ -252,7 +428,7 @@ class HeatMapWithTime(Layer):
                 })
                 .addTo({{this._parent.get_name()}});
 
-            var {{this.get_name()}} = new TDHeatmap({{this.data}},
+            var {{this.get_name()}} = new TDHeatmap({{this.data_json()}},
             {heatmapOptions: {
                     radius: {{this.radius}},
                     minOpacity: {{this.min_opacity}},
@@ -273,18 +449,22 @@ class HeatMapWithTime(Layer):
 	             use_local_extrema=False, auto_play=False,
 	             display_index=True, index_steps=1, min_speed=0.1,
 	             max_speed=10, speed_step=0.1, position='bottomleft',
-	             overlay=True, control=True, show=True, time_slider_drag_update=True):
+	             overlay=True, control=True, show=True, time_slider_drag_update=True,
+	             data_json=None, bounds=None):
 		super(HeatMapWithTime, self).__init__(name=name, overlay=overlay,
 		                                      control=control, show=show)
 		self._name = 'HeatMap'
 		self._control_name = self.get_name() + 'Control'
 
 		# Input data.
-		self.data = data
+		if data is None and (data_json is None or index is None):
+			raise ValueError('Without data, both data_json and index are required.')
+		self.data = None if data is None else [_as_points(frame) for frame in data]
+		self._data_json, self._bounds = data_json, bounds
 		self.index = index if index is not None else [str(i) for i in range(1, len(data) + 1)]
-		if len(self.data) != len(self.index):
+		if self.data is not None and len(self.data) != len(self.index):
 			raise ValueError('Input data and index are not of compatible lengths.')  # noqa
-		self.times = list(range(1, len(data) + 1))
+		self.times = list(range(1, len(self.index) + 1))
 
 		# Heatmap settings.
 		self.radius = radius
@@ -316,8 +496,12 @@ class HeatMapWithTime(Layer):
 		self.time_slider_drag_update = str(time_slider_drag_update).lower()
 		self.style_NS = 'leaflet-control-timecontrol'
 
+	def data_json(self):
+		return _json_slot(self, lambda: _frames_to_json(self.data) if self._data_json is None else self._data_json)
+
 	def render(self, **kwargs):
-		super(HeatMapWithTime, self).render(**kwargs)
+		with stats.timer('heatmap.serialize'):
+			_render_apart(self, super(HeatMapWithTime, self).render, **kwargs)
 
 		figure = self.get_root()
 		assert isinstance(figure, Figure), ('You cannot render this Element if it is not in a Figure.')
@@ -330,107 +514,97 @@ class HeatMapWithTime(Layer):
 		for name, url in _default_css:
 			figure.header.add_child(CssLink(url), name=name)
 
-		figure.header.add_child(
-			Element(
-				"""
-			<script>
-				var TDHeatmap = L.TimeDimension.Layer.extend({
-
-			initialize: function(data, options) {
-				var heatmapCfg = {
-					radius: 15,
-					maxOpacity: 1.,
-					scaleRadius: false,
-					useLocalExtrema: false,
-					latField: 'lat',
-					lngField: 'lng',
-					valueField: 'count',
-					defaultWeight : 1,
-				};
-				heatmapCfg = $.extend({}, heatmapCfg, options.heatmapOptions || {});
-				var layer = new HeatmapOverlay(heatmapCfg);
-				L.TimeDimension.Layer.prototype.initialize.call(this, layer, options);
-				this._currentLoadedTime = 0;
-				this._currentTimeData = {
-					data: []
-					};
-				this.data= data;
-				this.defaultWeight = heatmapCfg.defaultWeight || 1;
-			},
-			onAdd: function(map) {
-				L.TimeDimension.Layer.prototype.onAdd.call(this, map);
-				map.addLayer(this._baseLayer);
-				if (this._timeDimension) {
-					this._getDataForTime(this._timeDimension.getCurrentTime());
-				}
-			},
-			_onNewTimeLoading: function(ev) {
-				this._getDataForTime(ev.time);
-				return;
-			},
-			isReady: function(time) {
-				return (this._currentLoadedTime == time);
-			},
-			_update: function() {
-				this._baseLayer.setData(this._currentTimeData);
-				return true;
-			},
-			_getDataForTime: function(time) {
-					delete this._currentTimeData.data;
-					this._currentTimeData.data = [];
-					var data = this.data[time-1];
-					for (var i = 0; i < data.length; i++) {
-						this._currentTimeData.data.push({
-								lat: data[i][0],
-								lng: data[i][1],
-								count: data[i].length>2 ? data[i][2] : this.defaultWeight
-							});
-						}
-					this._currentLoadedTime = time;
-					if (this._timeDimension && time == this._timeDimension.getCurrentTime() && !this._timeDimension.isLoading()) {
-						this._update();
-					}
-					this.fire('timeload', {
-						time: time
-					});
-				}
-		});
-
-		L.Control.TimeDimensionCustom = L.Control.TimeDimension.extend({
-			initialize: function(index, options) {
-				var playerOptions = {
-					buffer: 1,
-					minBufferReady: -1
-					};
-				options.playerOptions = $.extend({}, playerOptions, options.playerOptions || {});
-				L.Control.TimeDimension.prototype.initialize.call(this, options);
-				this.index = index;
-				},
-			_getDisplayDateFormat: function(date){
-				return this.index[date.getTime()-1];
-				}
-			});
-			</script>
-				""",  # noqa
-				template_name='timeControlScript'
-			)
-		)
-
 	def _get_self_bounds(self):
 		"""
 		Computes the bounds of the object itself (not including it's children)
-		in the form [[lat_min, lon_min], [lat_max, lon_max]].
+		over all time frames in the form [[lat_min, lon_min], [lat_max, lon_max]].
 		"""
-		bounds = [[None, None], [None, None]]
-		for point in self.data:
-			bounds = [
-				[
-					none_min(bounds[0][0], point[0]),
-					none_min(bounds[0][1], point[1]),
-				],
-				[
-					none_max(bounds[1][0], point[0]),
-					none_max(bounds[1][1], point[1]),
-				],
-			]
-		return bounds
+		return self._bounds if self.data is None else _frames_bounds(self.data)
+
+
+class HeatMapFramesWithTime(HeatMapWithTime):
+	"""
+	Create a time-stamped heatmap layer whose frames are not in the HTML, but
+	fetched by the browser one at a time, as they are shown, from the output
+	directory of HeatmapStore.write_frames() (see heatstore.py). The frame
+	list is read from its index.json when the map is opened, so frames
+	written by later updates show up without regenerating the HTML. The
+	directory must be served over HTTP(S) along with the HTML.
+
+	Parameters
+	----------
+	url : string
+		URL of the write_frames() output directory as seen from the HTML page.
+	index : list of labels (e.g. time stamps) of the frames when the HTML is
+		generated, replaced by the frame times of index.json once loaded.
+	name : string, default None
+		The name of the Layer, as it will appear in LayerControls.
+	additional : bool, default False
+		Attach to the time slider of a HeatMapWithTime already on the map,
+		frame by frame in order, instead of creating one.
+	bounds : default None
+		The bounds [[lat_min, lon_min], [lat_max, lon_max]] of the frames.
+	**kwargs
+		Other HeatMapWithTime arguments, e.g. radius, gradient, auto_play.
+	"""
+	_template = Template(u"""
+        {% macro script(this, kwargs) %}
+            {% if not this.additional %}
+            {{this._parent.get_name()}}.timeDimension = L.timeDimension(
+                {times : {{this.times}}, currentTime: new Date(1)}
+            );
+
+            var {{this._control_name}} = new L.Control.TimeDimensionCustom({{this.index}}, {
+                autoPlay: {{this.auto_play}},
+                backwardButton: {{this.backward_button}},
+                displayDate: {{this.display_index}},
+                forwardButton: {{this.forward_button}},
+                limitMinimumRange: {{this.limit_minimum_range}},
+                limitSliders: {{this.limit_sliders}},
+                loopButton: {{this.loop_button}},
+                maxSpeed: {{this.max_speed}},
+                minSpeed: {{this.min_speed}},
+                playButton: {{this.play_button}},
+                playReverseButton: {{this.play_reverse_button}},
+                position: "{{this.position}}",
+                speedSlider: {{this.speed_slider}},
+                speedStep: {{this.speed_step}},
+                styleNS: "{{this.style_NS}}",
+                timeSlider: {{this.time_slider}},
+                timeSliderDragUpdate: {{this.time_slider_drag_update}},
+                timeSteps: {{this.index_steps}}
+                })
+                .addTo({{this._parent.get_name()}});
+            {% endif %}
+
+            var {{this.get_name()}} = new TDHeatmapFrames({{ this.url|tojson }},
+            {heatmapOptions: {
+                    radius: {{this.radius}},
+                    minOpacity: {{this.min_opacity}},
+                    maxOpacity: {{this.max_opacity}},
+                    scaleRadius: {{this.scale_radius}},
+                    useLocalExtrema: {{this.use_local_extrema}},
+                    defaultWeight: 1,
+                    {% if this.gradient %}gradient: {{ this.gradient }}{% endif %}
+                }
+            })
+            .addTo({{this._parent.get_name()}});
+            {% if not this.additional %}
+            {{this.get_name()}}.onIndex(function(index){
+                if(!index.times.length) return;
+                {{this._control_name}}.index = index.times;
+                {{this._parent.get_name()}}.timeDimension.setAvailableTimes(index.times.map(function(t, i){ return i+1; }), 'replace');
+            });
+            {% endif %}
+        {% endmacro %}
+        """)
+
+	def __init__(self, url, index, name=None, additional=False, bounds=None, **kwargs):
+		super(HeatMapFramesWithTime, self).__init__([[]] * len(index), index=list(index), name=name, **kwargs)
+		self._name = 'HeatMapFrames'
+		self.url = url
+		self.additional = additional
+		self._bounds = bounds
+
+	def _get_self_bounds(self):
+		return self._bounds or [[None, None], [None, None]]
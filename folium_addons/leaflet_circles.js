@@ -0,0 +1,107 @@
+// Batched circle layer for Leaflet: all circles of a layer are drawn onto one canvas in a single loop.
+// data is a packed array [lat0, lng0, radius0, count0, lat1, lng1, radius1, count1, ...], radius in metres.
+
+(function(){
+	var STRIDE = 4;
+	var EARTH_CIRCUMFERENCE = 40075016.686;
+
+	function parseOpacity(v, def){
+		if(v == null) return def;
+		if(typeof(v) == 'string') return v.trim().endsWith('%') ? parseFloat(v)/100 : parseFloat(v);
+		return v;
+	}
+
+	L.CircleCanvas = L.Layer.extend({
+		options: {
+			color: '#3388ff',
+			weight: 3,
+			opacity: 1,
+			fill: true,
+			fillColor: null,
+			fillOpacity: 0.2,
+			popup: true
+		},
+
+		initialize: function(data, options){
+			L.setOptions(this, options);
+			this._data = data;
+			this._n = Math.floor(data.length/STRIDE);
+			this._px = new Float32Array(this._n*3);
+		},
+
+		onAdd: function(map){
+			this._canvas = L.DomUtil.create('canvas', 'leaflet-layer leaflet-zoom-hide');
+			this._ctx = this._canvas.getContext('2d');
+			this.getPane().appendChild(this._canvas);
+			map.on('moveend zoomend resize viewreset', this._redraw, this);
+			if(this.options.popup) map.on('click', this._onClick, this);
+			this._redraw();
+		},
+
+		onRemove: function(map){
+			map.off('moveend zoomend resize viewreset', this._redraw, this);
+			map.off('click', this._onClick, this);
+			L.DomUtil.remove(this._canvas);
+		},
+
+		_redraw: function(){
+			var map = this._map, size = map.getSize(), ratio = L.Browser.retina ? 2 : 1;
+			var canvas = this._canvas, ctx = this._ctx, o = this.options;
+			L.DomUtil.setPosition(canvas, map.containerPointToLayerPoint([0, 0]));
+			canvas.width = size.x*ratio;
+			canvas.height = size.y*ratio;
+			canvas.style.width = size.x+'px';
+			canvas.style.height = size.y+'px';
+			ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+			ctx.clearRect(0, 0, size.x, size.y);
+
+			ctx.strokeStyle = o.color;
+			ctx.fillStyle = o.fillColor || o.color;
+			ctx.lineWidth = o.weight;
+			var opacity = parseOpacity(o.opacity, 1), fillOpacity = parseOpacity(o.fillOpacity, 0.2);
+			var stroke = o.weight > 0 && opacity > 0, fill = o.fill && fillOpacity > 0;
+
+			// metres per pixel at the equator for the current zoom
+			var mpp = EARTH_CIRCUMFERENCE/(256*Math.pow(2, map.getZoom()));
+			var data = this._data, px = this._px, d2r = Math.PI/180;
+			for(var i=0, j=0, k=0; i<this._n; ++i, j+=STRIDE, k+=3){
+				var p = map.latLngToContainerPoint([data[j], data[j+1]]);
+				var r = Math.max(data[j+2]/(mpp*Math.cos(data[j]*d2r)), 1);
+				px[k] = p.x; px[k+1] = p.y; px[k+2] = r;
+				if(p.x+r < 0 || p.y+r < 0 || p.x-r > size.x || p.y-r > size.y) continue;
+				ctx.beginPath();
+				ctx.arc(p.x, p.y, r, 0, 2*Math.PI);
+				if(fill){
+					ctx.globalAlpha = fillOpacity;
+					ctx.fill();
+				}
+				if(stroke){
+					ctx.globalAlpha = opacity;
+					ctx.stroke();
+				}
+			}
+		},
+
+		_onClick: function(e){
+			// hit-test: the smallest circle containing the click wins
+			var x = e.containerPoint.x, y = e.containerPoint.y, px = this._px, best = -1, best_r = Infinity;
+			for(var i=0, k=0; i<this._n; ++i, k+=3){
+				var dx = px[k]-x, dy = px[k+1]-y, r = px[k+2];
+				if(r < best_r && dx*dx+dy*dy <= r*r){
+					best = i;
+					best_r = r;
+				}
+			}
+			var j = best*STRIDE, data = this._data;
+			if(best < 0 || isNaN(data[j+3])) return;
+			L.popup()
+				.setLatLng([data[j], data[j+1]])
+				.setContent('count: '+data[j+3])
+				.openOn(this._map);
+		}
+	});
+
+	L.circleCanvas = function(data, options){
+		return new L.CircleCanvas(data, options);
+	};
+})();
@@ -0,0 +1,125 @@
+// The time-stamped heatmap layer of HeatMapWithTime, one data array per time frame drawn by HeatmapOverlay, and the
+// time slider control showing the frame labels of HeatMapWithTime instead of dates.
+
+var TDHeatmap = L.TimeDimension.Layer.extend({
+	initialize: function(data, options){
+		var heatmapCfg = {
+			radius: 15,
+			maxOpacity: 1.,
+			scaleRadius: false,
+			useLocalExtrema: false,
+			latField: 'lat',
+			lngField: 'lng',
+			valueField: 'count',
+			defaultWeight : 1,
+		};
+		heatmapCfg = $.extend({}, heatmapCfg, options.heatmapOptions || {});
+		var layer = new HeatmapOverlay(heatmapCfg);
+		L.TimeDimension.Layer.prototype.initialize.call(this, layer, options);
+		this._currentLoadedTime = 0;
+		this._currentTimeData = {
+			data: []
+		};
+		this.data = data;
+		this.defaultWeight = heatmapCfg.defaultWeight || 1;
+	},
+
+	onAdd: function(map){
+		L.TimeDimension.Layer.prototype.onAdd.call(this, map);
+		map.addLayer(this._baseLayer);
+		if(this._timeDimension){
+			this._getDataForTime(this._timeDimension.getCurrentTime());
+		}
+	},
+
+	_onNewTimeLoading: function(ev){
+		this._getDataForTime(ev.time);
+		return;
+	},
+
+	isReady: function(time){
+		return (this._currentLoadedTime == time);
+	},
+
+	_update: function(){
+		this._baseLayer.setData(this._currentTimeData);
+		return true;
+	},
+
+	_getDataForTime: function(time){
+		delete this._currentTimeData.data;
+		this._currentTimeData.data = [];
+		var data = this.data[time-1];
+		for(var i = 0; i < data.length; i++){
+			this._currentTimeData.data.push({
+				lat: data[i][0],
+				lng: data[i][1],
+				count: data[i].length>2 ? data[i][2] : this.defaultWeight
+			});
+		}
+		this._currentLoadedTime = time;
+		if(this._timeDimension && time == this._timeDimension.getCurrentTime() && !this._timeDimension.isLoading()){
+			this._update();
+		}
+		this.fire('timeload', {
+			time: time
+		});
+	}
+});
+
+L.Control.TimeDimensionCustom = L.Control.TimeDimension.extend({
+	initialize: function(index, options){
+		var playerOptions = {
+			buffer: 1,
+			minBufferReady: -1
+		};
+		options.playerOptions = $.extend({}, playerOptions, options.playerOptions || {});
+		L.Control.TimeDimension.prototype.initialize.call(this, options);
+		this.index = index;
+	},
+
+	_getDisplayDateFormat: function(date){
+		return this.index[date.getTime()-1];
+	}
+});
+
+// TDHeatmap whose frames are fetched on demand from the output directory of HeatmapStore.write_frames(): url/index.json
+// lists the frame files in time order and the normalization weight = count*(1-min_weight)/vmax + min_weight, and frame
+// number t is the t-th file. Both are revalidated with the server, so that frames rewritten by an update are picked up.
+var TDHeatmapFrames = TDHeatmap.extend({
+	initialize: function(url, options){
+		TDHeatmap.prototype.initialize.call(this, [], options);
+		this._url = url.replace(/\/$/, '');
+		this._files = {};
+		this._index = fetch(this._url+'/index.json', {cache: 'no-cache'}).then(function(r){
+			return r.json();
+		});
+	},
+
+	onIndex: function(callback){
+		this._index.then(callback);
+		return this;
+	},
+
+	_getDataForTime: function(time){
+		var self = this;
+		this._index.then(function(index){
+			var fn = index.files[time-1];
+			if(!fn) return [];
+			if(!(fn in self._files)){
+				self._files[fn] = fetch(self._url+'/'+fn, {cache: 'no-cache'}).then(function(r){
+					return r.json();
+				});
+			}
+			return self._files[fn].then(function(frame){
+				var a = index.vmax > 0 ? (1-index.min_weight)/index.vmax : 0, b = index.vmax > 0 ? index.min_weight : 1;
+				return frame.map(function(p){
+					return [p[0], p[1], p[2]*a+b];
+				});
+			});
+		}).then(function(data){
+			self.data[time-1] = data;
+			TDHeatmap.prototype._getDataForTime.call(self, time);
+		});
+	}
+});
@@ -0,0 +1,52 @@
+// Time-stamped raster tiles for Leaflet.TimeDimension: one pre-rendered tile set per time frame.
+// url is a tile URL template with a {t} placeholder for the frame number (1-based), e.g. 'tiles/{t}/{z}/{x}/{y}.png'.
+
+(function(){
+	L.TimeDimension.Layer.TileFrames = L.TimeDimension.Layer.extend({
+		initialize: function(url, options){
+			this._url = url;
+			var layer = L.tileLayer(this._frameUrl(1), options.tileOptions || {});
+			L.TimeDimension.Layer.prototype.initialize.call(this, layer, options);
+			this._currentLoadedTime = 0;
+		},
+
+		_frameUrl: function(time){
+			return this._url.replace('{t}', time);
+		},
+
+		onAdd: function(map){
+			L.TimeDimension.Layer.prototype.onAdd.call(this, map);
+			map.addLayer(this._baseLayer);
+			if(this._timeDimension) this._loadTime(this._timeDimension.getCurrentTime());
+		},
+
+		onRemove: function(map){
+			map.removeLayer(this._baseLayer);
+			L.TimeDimension.Layer.prototype.onRemove.call(this, map);
+		},
+
+		_onNewTimeLoading: function(ev){
+			this._loadTime(ev.time);
+		},
+
+		isReady: function(time){
+			return this._currentLoadedTime == time;
+		},
+
+		_update: function(){
+			if(this._currentLoadedTime) this._baseLayer.setUrl(this._frameUrl(this._currentLoadedTime));
+			return true;
+		},
+
+		_loadTime: function(time){
+			this._currentLoadedTime = time;
+			if(this._timeDimension && time == this._timeDimension.getCurrentTime() && !this._timeDimension.isLoading())
+				this._update();
+			this.fire('timeload', {time: time});
+		}
+	});
+
+	L.timeDimension.layer.tileFrames = function(url, options){
+		return new L.TimeDimension.Layer.TileFrames(url, options);
+	};
+})();
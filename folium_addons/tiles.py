@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from branca.element import Figure, JavascriptLink
+from folium.utilities import parse_options
+
+from jinja2 import Template
+
+from folium_addons.heatmaps import _default_prefix, HeatMapWithTime
+
+
+_default_js3 = [
+    ('leaflet-tile-frames.js',
+     _default_prefix+'leaflet_tile_frames.js'),
+    ]
+
+
+class TileFramesWithTime(HeatMapWithTime):
+	"""
+	Create a time-stamped layer of pre-rendered raster tiles (see rasterheat.py),
+	one tile set per time frame, played through the same time slider as
+	HeatMapWithTime.
+
+	Parameters
+	----------
+	url : string
+		Tile URL template with a {t} placeholder for the frame number (from 1),
+		e.g. 'tiles/{t}/{z}/{x}/{y}.png'.
+	index : list of labels (e.g. time stamps), one per frame.
+	name : string, default None
+		The name of the Layer, as it will appear in LayerControls.
+	additional : bool, default False
+		Attach to the time slider of a HeatMapWithTime (or another
+		TileFramesWithTime) already on the map, instead of creating one.
+	min_zoom, max_zoom : int, default 0 and 18
+		Zoom range of the layer.
+	min_native_zoom, max_native_zoom : int, default None
+		Zoom range of the rendered tiles, tiles are scaled beyond it.
+	opacity : float, default 1
+		Opacity of the tiles.
+	**kwargs
+		Time slider options of HeatMapWithTime, e.g. auto_play, position.
+	"""
+	_template = Template(u"""
+        {% macro script(this, kwargs) %}
+            {% if not this.additional %}
+            {{this._parent.get_name()}}.timeDimension = L.timeDimension(
+                {times : {{this.times}}, currentTime: new Date(1)}
+            );
+
+            var {{this._control_name}} = new L.Control.TimeDimensionCustom({{this.index}}, {
+                autoPlay: {{this.auto_play}},
+                backwardButton: {{this.backward_button}},
+                displayDate: {{this.display_index}},
+                forwardButton: {{this.forward_button}},
+                limitMinimumRange: {{this.limit_minimum_range}},
+                limitSliders: {{this.limit_sliders}},
+                loopButton: {{this.loop_button}},
+                maxSpeed: {{this.max_speed}},
+                minSpeed: {{this.min_speed}},
+                playButton: {{this.play_button}},
+                playReverseButton: {{this.play_reverse_button}},
+                position: "{{this.position}}",
+                speedSlider: {{this.speed_slider}},
+                speedStep: {{this.speed_step}},
+                styleNS: "{{this.style_NS}}",
+                timeSlider: {{this.time_slider}},
+                timeSliderDragUpdate: {{this.time_slider_drag_update}},
+                timeSteps: {{this.index_steps}}
+                })
+                .addTo({{this._parent.get_name()}});
+            {% endif %}
+
+            var {{this.get_name()}} = L.timeDimension.layer.tileFrames(
+                {{ this.url|tojson }},
+                {tileOptions: {{ this.tile_options|tojson }}}
+            ).addTo({{this._parent.get_name()}});
+        {% endmacro %}
+        """)
+
+	def __init__(self, url, index, name=None, additional=False, min_zoom=0, max_zoom=18,
+	             min_native_zoom=None, max_native_zoom=None, opacity=1, attr='', **kwargs):
+		super(TileFramesWithTime, self).__init__([[]] * len(index), index=list(index), name=name, **kwargs)
+		self._name = 'TileFrames'
+		self.url = url
+		self.additional = additional
+		self.tile_options = parse_options(
+			min_zoom=min_zoom,
+			max_zoom=max_zoom,
+			min_native_zoom=min_native_zoom,
+			max_native_zoom=max_native_zoom,
+			opacity=opacity,
+			attribution=attr,
+		)
+
+	def render(self, **kwargs):
+		super(TileFramesWithTime, self).render(**kwargs)
+
+		figure = self.get_root()
+		assert isinstance(figure, Figure), ('You cannot render this Element if it is not in a Figure.')
+
+		for name, url in _default_js3:
+			figure.header.add_child(JavascriptLink(url), name=name)
+
+	def _get_self_bounds(self):
+		# the tiles are only known to the browser
+		return [[None, None], [None, None]]
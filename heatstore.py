@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Incremental time-stamped heatmaps, requires draw_util
+# Per-(time-bin, location) counts are kept on disk, so that an update only needs to geocode and bin the new events,
+# and only the frames affected by the new events need to be re-emitted, as the sidecar files of write_frames() that the
+# layer of heatmap(url=...) fetches
+
+import os, json
+from draw_util import *
+
+
+class HeatmapStore:
+	def __init__(self, fn=None, freq='1D', smooth=0, min_weight=0.25):
+		# freq, smooth, min_weight: same as in showHeatmaps(), fixed once the store holds data
+		self.fn = fn
+		self.freq, self.smooth, self.min_weight = freq, smooth, min_weight
+		self.origin = None
+		self.vmax = 0
+		self.agg = pd.Series([], dtype=float, name='count',
+		                     index=pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), [], []], names=['datetime', 'latitude', 'longitude']))
+		if fn and os.path.exists(fn):
+			self.load(fn)
+
+	@property
+	def frame_freq(self):
+		# the time step between frames, smooth<0 interpolates abs(smooth) frames between every two periods
+		return pd.to_timedelta(self.freq) / (1 - self.smooth if self.smooth < 0 else 1)
+
+	@property
+	def time_range(self):
+		times = self.agg.index.get_level_values(0)
+		return (times.min(), times.max()) if len(times) else (None, None)
+
+	def all_times(self):
+		tmin, tmax = self.time_range
+		return list(pd.date_range(tmin, tmax, freq=self.frame_freq)) if tmin is not None else []
+
+	def snap(self, times):
+		# map times onto the start of their frame, frames are aligned to midnight of the first day in the store
+		f = self.frame_freq
+		return self.origin + ((pd.DatetimeIndex(times) - self.origin) // f) * f
+
+	def add(self, df):
+		# fold new events into the per-(frame, location) counts, without working out the changed frames or the maximum;
+		# for bulk loading, e.g. the chunks of a large event log, followed by one update_vmax() after the last chunk
+		# OUTPUT: the new events summed per (frame, location)
+		df = inferLatLon(df)
+		if df.empty:
+			return self.agg.iloc[:0]
+		if self.origin is None:
+			self.origin = df.index.min().normalize()
+		new = pd.DataFrame({'datetime': self.snap(df.index), 'latitude': np.round(df['latitude'].values, 6),
+		                    'longitude': np.round(df['longitude'].values, 6), 'count': df['count'].values.astype(float)})
+		new = new.groupby(['datetime', 'latitude', 'longitude'])['count'].sum()
+		self.agg = new if self.agg.empty else self.agg.add(new, fill_value=0)
+		return new
+
+	def update_vmax(self):
+		_, data_list = self.frames(normalize=False)
+		self.vmax = max([0] + [frame[:, 2].max() for frame in data_list if len(frame)])
+		return self.vmax
+
+	def update(self, df):
+		# INPUT: new events, pd.DataFrame(columns=['address' or 'latitude'+'longitude', 'count'], index=pd.DatetimeIndex)
+		# OUTPUT: the sorted list of frame times that changed
+		old_tmin, old_tmax = self.time_range
+		new = self.add(df)
+		if new.empty:
+			return []
+
+		# new events spread to abs(smooth) adjacent frames, and frames outside the old time range are all new
+		f, N = self.frame_freq, abs(self.smooth)
+		bins = new.index.get_level_values(0).unique()
+		changed = set(t + f * k for t in bins for k in range(-N, N + 1))
+		changed |= set(t for t in self.all_times() if old_tmin is None or t < old_tmin or t > old_tmax)
+		tmin, tmax = self.time_range
+		changed = sorted(t for t in changed if tmin <= t <= tmax)
+
+		# counts never decrease, so the maximum only needs to be checked on the changed frames
+		_, data_list = self.frames(changed, normalize=False)
+		self.vmax = max([self.vmax] + [frame[:, 2].max() for frame in data_list if len(frame)])
+		return changed
+
+	def frames(self, times=None, normalize=True):
+		# OUTPUT: the list of frame times and the list of [latitude, longitude, weight] arrays of every frame
+		# weights are normalized onto [min_weight, 1] as in showHeatmaps(), or raw counts if normalize==False
+		times = self.all_times() if times is None else list(times)
+		if not times or self.agg.empty:
+			return times, [np.empty((0, 3)) for t in times]
+		f, N = self.frame_freq, abs(self.smooth)
+		df = self.agg.loc[min(times) - f * N: max(times) + f * N].reset_index().set_index('datetime')
+		df, _ = smooth_heatmap(df, self.freq, self.smooth, clip=self.time_range)
+		df.index = self.origin + ((df.index - self.origin) / f).round().astype(int) * f
+		df = df.groupby([df.index, 'latitude', 'longitude'])['count'].sum().reset_index(level=[1, 2])
+		if normalize:
+			df = norm_count(df, self.min_weight, self.vmax)
+		groups = {t: df1.values for t, df1 in df.groupby(level=0)}
+		return times, [groups.get(t, np.empty((0, 3))) for t in times]
+
+	def heatmap(self, color=None, name=None, additional=False, add_options={}, url=None):
+		# OUTPUT: the HeatMapWithTime layer of all frames as created by showHeatmaps(), or HeatMapWithTimeAdditional
+		# url: the URL of the write_frames() output directory as seen from the HTML page => a HeatMapFramesWithTime layer
+		#      that fetches the frames from there instead of inlining them, so that an update only needs write_frames()
+		options = {'min_opacity': 0, 'max_opacity': 1, 'name': name or color, **add_options}
+		if color:
+			options['gradient'] = {1: color if color.startswith('#') else colors.cnames[color]}
+		if url is not None:
+			lat, lon = self.agg.index.get_level_values(1), self.agg.index.get_level_values(2)
+			bounds = [[float(lat.min()), float(lon.min())], [float(lat.max()), float(lon.max())]] if len(lat) else None
+			return HeatMapFramesWithTime(url, [str(t) for t in self.all_times()], additional=additional, bounds=bounds, **options)
+		time_list, data_list = self.frames()
+		if additional:
+			return HeatMapWithTimeAdditional(data_list, **options)
+		return HeatMapWithTime(data_list, index=[str(t) for t in time_list], **options)
+
+	def write_frames(self, out_dir, times=None):
+		# write every frame in <times> (all frames by default) as a JSON sidecar file of [latitude, longitude, count],
+		# and an index.json with the frame list and the normalization: weight = count*(1-min_weight)/vmax + min_weight
+		# these are loaded by the layer of heatmap(url=...), e.g. after an update: store.write_frames(out_dir, store.update(df))
+		# OUTPUT: the list of files written
+		os.makedirs(out_dir, exist_ok=True)
+		frame_fn = lambda t: 'frame_%s.json' % t.strftime('%Y%m%dT%H%M%S')
+		times, data_list = self.frames(times, normalize=False)
+		written = []
+		for t, frame in zip(times, data_list):
+			with open(os.path.join(out_dir, frame_fn(t)), 'w') as fp:
+				json.dump(frame.tolist(), fp, separators=(',', ':'))
+			written += [frame_fn(t)]
+		all_times = self.all_times()
+		with open(os.path.join(out_dir, 'index.json'), 'w') as fp:
+			json.dump({'times': [str(t) for t in all_times], 'files': [frame_fn(t) for t in all_times],
+			           'freq': str(self.frame_freq), 'min_weight': self.min_weight, 'vmax': float(self.vmax)}, fp, indent=1)
+		return written + ['index.json']
+
+	def save(self, fn=None):
+		fn = fn or self.fn
+		meta = {'freq': self.freq, 'smooth': self.smooth, 'min_weight': self.min_weight, 'vmax': float(self.vmax),
+		        'origin': None if self.origin is None else str(self.origin)}
+		with open(fn, 'wb') as fp:
+			np.savez_compressed(fp, meta=json.dumps(meta),
+			                    datetime=self.agg.index.get_level_values(0).values.astype('datetime64[ns]').astype(np.int64),
+			                    latitude=self.agg.index.get_level_values(1).values.astype(float),
+			                    longitude=self.agg.index.get_level_values(2).values.astype(float),
+			                    count=self.agg.values.astype(float))
+		return fn
+
+	def load(self, fn):
+		with np.load(fn) as data:
+			meta = json.loads(str(data['meta']))
+			index = pd.MultiIndex.from_arrays([pd.DatetimeIndex(data['datetime'].astype('datetime64[ns]')), data['latitude'], data['longitude']],
+			                                  names=['datetime', 'latitude', 'longitude'])
+			self.agg = pd.Series(data['count'], index=index, name='count')
+		self.freq, self.smooth, self.min_weight, self.vmax = meta['freq'], meta['smooth'], meta['min_weight'], meta['vmax']
+		self.origin = None if meta['origin'] is None else pd.Timestamp(meta['origin'])
+		return self
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Size optimizer of the HTML files of generated maps, requires folium_addons
+# - floats in the code of the inline scripts are rounded to a fixed number of decimals, 6 decimals of a degree are ~0.1m
+# - the code of the inline scripts loses its indentation, blank lines and the spaces after commas between numbers; no
+#   lines are joined, so the scripts do not depend on semicolon insertion rules
+# - string literals and comments are left as they are, so that the texts of popups, tooltips, etc. are unchanged
+# - optionally, the folium_addons scripts and stylesheets are inlined, each once, so that the map is a single file
+# - optionally, the output is precompressed as .html.gz, which web servers can serve as it is
+
+import os, re, sys, gzip, argparse
+from folium_addons.heatmaps import _default_prefix
+
+# the folium_addons assets, and their links in the header of a map, with any indentation and line break around them
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'folium_addons')
+ASSET_LINK = re.compile(r'[ \t]*(?:<script src="%s([^"/]+\.js)"></script>|<link rel="stylesheet" href="%s([^"/]+\.css)"/>)\n?'
+                        % ((re.escape(_default_prefix),) * 2))
+
+INLINE_SCRIPT = re.compile(r'(<script>)(.*?)(</script>)', re.S)
+JS_LITERAL = re.compile(r'''("(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|`(?:[^`\\]|\\.)*`|//[^\n]*|/\*.*?\*/)''', re.S)
+NUM_SEP = re.compile(r', (?<=[\d\]], )(?=[-\d\[])')  # the lookbehind after the literal is much faster to scan
+BLANK_LINES = re.compile(r'\n[ \t]*(?=\n)')
+INDENT = re.compile(r'(?<=\n)[ \t]+')
+HTML_BLANK_LINES = re.compile(r'(<script>.*?</script>)|\n[ \t]*(?=\n)', re.S)
+
+
+def float_pattn(decimals):
+	# floats with more than <decimals> decimals, not part of a name or of a longer dotted number
+	return re.compile(r'(?<![\w.])(-?\d+\.\d{%d}\d+)(?![\w.])' % decimals)
+
+
+def code_apart(js, func):
+	# apply <func> to the code of <js> only, between its string literals and comments
+	# (regular expression literals are taken as code, the scripts of the generated maps have none)
+	parts = JS_LITERAL.split(js)
+	parts[::2] = [func(code) for code in parts[::2]]
+	return ''.join(parts)
+
+
+def quantize(js, decimals=6):
+	# round every float literal in the code of <js> with more than <decimals> decimals
+	fmt = '%%.%df' % decimals
+	def repl(m):
+		s = (fmt % float(m.group(1))).rstrip('0').rstrip('.')
+		return '0' if s == '-0' else s
+	pattn = float_pattn(decimals)
+	return code_apart(js, lambda code: pattn.sub(repl, code))
+
+
+def minify(js):
+	# strip the indentation, the blank lines and the spaces after commas between numbers and arrays in the code of <js>
+	# the leading newline makes the first line indented like any other
+	return code_apart('\n' + js, lambda code: NUM_SEP.sub(',', INDENT.sub('', BLANK_LINES.sub('', code))))[1:]
+
+
+def inline_assets(html, asset_dir=ASSET_DIR):
+	# replace the links to the folium_addons assets by their contents, every asset is inlined at its first link only
+	seen = set()
+	def repl(m):
+		fn = m.group(1) or m.group(2)
+		if fn in seen:
+			return ''
+		seen.add(fn)
+		txt = open(os.path.join(asset_dir, fn)).read().rstrip('\n')
+		return ('<script>\n%s\n</script>' if m.group(1) else '<style>\n%s\n</style>') % txt + '\n' * m.group(0).endswith('\n')
+	return ASSET_LINK.sub(repl, html)
+
+
+def optimize_html(html, decimals=6, strip=True, inline=False, asset_dir=ASSET_DIR):
+	# INPUT: the HTML of a map, e.g. map_obj.get_root().render()
+	# decimals: the number of decimals kept in the floats of the inline scripts, None keeps them all
+	# strip: whether to strip whitespace in the inline scripts; inline: whether to inline the folium_addons assets
+	def opt_script(m):
+		js = m.group(2)
+		if decimals is not None:
+			js = quantize(js, decimals)
+		if strip:
+			js = minify(js)
+		return m.group(1) + js + m.group(3)
+	html = INLINE_SCRIPT.sub(opt_script, html)
+	if strip:
+		# blank lines between the tags, the scripts are left to minify()
+		html = HTML_BLANK_LINES.sub(lambda m: m.group(1) or '', html)
+	# the assets are inlined last, so that the libraries are left untouched
+	return inline_assets(html, asset_dir) if inline else html
+
+
+def save_map(map_obj, fn, decimals=6, strip=True, inline=False, compress=None, asset_dir=ASSET_DIR):
+	# render a folium map and write its optimized HTML to <fn>, gzipped if compress or <fn> ends with .gz
+	# OUTPUT: a size report in bytes: 'raw' before optimization, 'html' after, and 'gzip' if compressed
+	html = map_obj.get_root().render()
+	return save_html(html, fn, decimals, strip, inline, compress, asset_dir)
+
+
+def save_html(html, fn, decimals=6, strip=True, inline=False, compress=None, asset_dir=ASSET_DIR):
+	# same as save_map(), for already rendered HTML
+	raw = len(html.encode('utf8'))
+	data = optimize_html(html, decimals, strip, inline, asset_dir).encode('utf8')
+	report = {'file': fn, 'raw': raw, 'html': len(data)}
+	if compress or (compress is None and fn.endswith('.gz')):
+		fn = fn if fn.endswith('.gz') else fn + '.gz'
+		data = gzip.compress(data, compresslevel=9)
+		report.update({'file': fn, 'gzip': len(data)})
+	with open(fn, 'wb') as fp:
+		fp.write(data)
+	report['reduction'] = 1 - len(data) / raw if raw else 0.
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] input.html output.html[.gz]',
+	                                 description='shrink the HTML file of a generated map, and report the size reduction',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('input', help='the HTML file of a map')
+	parser.add_argument('output', help='the optimized HTML file, gzipped if it ends with .gz')
+	parser.add_argument('--decimals', '-d', help='decimals kept in the floats of the scripts, -1 to keep them all', type=int, default=6)
+	parser.add_argument('--no-strip', '-n', help='do not strip whitespace in the scripts', action='store_true')
+	parser.add_argument('--inline', '-i', help='inline the folium_addons scripts and stylesheets', action='store_true')
+	parser.add_argument('--asset-dir', '-a', help='directory of the folium_addons assets', default=ASSET_DIR)
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	report = save_html(open(input).read(), output, None if decimals < 0 else decimals, not no_strip, inline, None, asset_dir)
+	print('%s: %d => %d bytes (%.1f%% smaller)' % (report['file'], report['raw'], report.get('gzip', report['html']), report['reduction'] * 100),
+	      file=sys.stderr)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Offline heatmap rasterizer: renders [latitude, longitude, weight] points into XYZ (Web Mercator) PNG tiles, so that
+# the browser only loads images and its cost no longer depends on the number of points
+# The drawing follows Leaflet.heat (folium_addons/leaflet_heat.min.js), which draws static heatmaps in the browser:
+# - points are summed into cells of (radius+blur)/2 pixels, each placed at the weighted centroid of its points
+# - every cell stamps a disk of <radius> pixels blurred by <blur> with opacity max(sum/max, min_opacity),
+#   where max is the largest cell sum (at least 1); the stamps are alpha-composited over each other
+# - the composited alpha picks the color from the gradient, and stays as the alpha of the pixel
+# Unlike in the browser, max is taken over all cells at a zoom level instead of the cells in the current view, so that
+# adjacent tiles match.
+
+import os, json, argparse
+import numpy as np
+from matplotlib import colors
+import matplotlib.image
+
+DEFAULT_GRADIENT = {0.4: 'blue', 0.6: 'cyan', 0.7: 'lime', 0.8: 'yellow', 1.0: 'red'}
+
+
+def latlon_to_pixel(lat, lon, zoom, tile_size=256):
+	# OUTPUT: (x, y) global Web Mercator pixel coordinates at <zoom>
+	scale = tile_size * 2.0 ** zoom
+	sin_lat = np.sin(np.radians(np.clip(lat, -85.05112878, 85.05112878)))
+	x = (np.asarray(lon, dtype=float) + 180) / 360 * scale
+	y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+	return x, y
+
+
+def heat_kernel(radius, blur):
+	# the opacity of one point: a disk of <radius> pixels blurred like the canvas shadowBlur (Gaussian, sigma=blur/2),
+	# on a (2r, 2r) grid with r = radius+blur, centred at (r, r) as in simpleheat
+	r = radius + blur
+	c = np.arange(2 * r) + 0.5 - r
+	disk = (c[:, None] ** 2 + c[None, :] ** 2 <= radius ** 2).astype(float)
+	if blur <= 0:
+		return disk
+	sigma = blur / 2
+	g = np.exp(-0.5 * (np.arange(-2 * blur, 2 * blur + 1) / sigma) ** 2)
+	g /= g.sum()
+	conv = lambda v: np.convolve(v, g)[2 * blur: 2 * blur + 2 * r]
+	return np.apply_along_axis(conv, 1, np.apply_along_axis(conv, 0, disk))
+
+
+def gradient_lut(gradient=None):
+	# OUTPUT: (256, 3) uint8 colors of the gradient {stop: color}, as the 256-pixel canvas linear gradient in simpleheat
+	stops = sorted((float(k), colors.to_rgb(v)) for k, v in (gradient or DEFAULT_GRADIENT).items())
+	pos = np.array([p for p, _ in stops])
+	rgb = np.array([c for _, c in stops])
+	t = (np.arange(256) + 0.5) / 256
+	return np.round(np.column_stack([np.interp(t, pos, rgb[:, k]) for k in range(3)]) * 255).astype(np.uint8)
+
+
+class HeatTileRenderer:
+	def __init__(self, radius=11, blur=8, gradient=None, min_opacity=0.05, tile_size=256):
+		# radius, blur: in pixels, as in folium_addons.heatmaps.HeatMap; min_opacity: as in simpleheat, where 0 means 0.05
+		self.radius, self.blur, self.tile_size = int(round(radius)), int(round(blur)), tile_size
+		self.min_opacity = min_opacity or 0.05
+		self.r = self.radius + self.blur
+		self.cell = self.r / 2
+		self.kernel = heat_kernel(self.radius, self.blur)
+		self.lut = gradient_lut(gradient)
+		# stamp offsets and opacities, without the fully transparent corners
+		ky, kx = np.nonzero(self.kernel > 0)
+		self.k_dx, self.k_dy, self.k_val = kx - self.r, ky - self.r, self.kernel[ky, kx]
+		# log(1 - opacity*kernel) of every stamp pixel, for the opacities quantized to 8 bits as on a canvas
+		self.log_t = np.log1p(-np.minimum(np.arange(256)[:, None] / 255 * self.k_val[None, :], 1 - 1e-6)).astype(np.float32)
+
+	def cells(self, points, zoom):
+		# OUTPUT: (x, y, opacity) of the non-empty cells at <zoom>, x and y in global pixels
+		points = np.asarray(points, dtype=float).reshape(-1, 3)
+		points = points[~np.isnan(points).any(axis=1)]
+		x, y = latlon_to_pixel(points[:, 0], points[:, 1], zoom, self.tile_size)
+		w = points[:, 2]
+		key = np.floor(x / self.cell).astype(np.int64) * (1 << 32) + np.floor(y / self.cell).astype(np.int64)
+		uniq, inv = np.unique(key, return_inverse=True)
+		s = np.bincount(inv, weights=w, minlength=len(uniq))
+		with np.errstate(invalid='ignore', divide='ignore'):
+			cx = np.bincount(inv, weights=x * w, minlength=len(uniq)) / s
+			cy = np.bincount(inv, weights=y * w, minlength=len(uniq)) / s
+		ok = s > 0
+		vmax = max(1, s.max()) if len(s) else 1
+		opacity = np.clip(np.maximum(s / vmax, self.min_opacity), 0, 1)
+		return np.round(cx[ok]), np.round(cy[ok]), opacity[ok]
+
+	def render_tile(self, x, y, opacity, tx, ty):
+		# INPUT: cells in global pixels, and the tile column/row
+		# OUTPUT: (tile_size, tile_size, 4) uint8 RGBA image
+		T = self.tile_size
+		px = (x[:, None] - tx * T + self.k_dx[None, :]).astype(np.int64)
+		py = (y[:, None] - ty * T + self.k_dy[None, :]).astype(np.int64)
+		inside = (px >= 0) & (px < T) & (py >= 0) & (py < T)
+		# alpha compositing of all stamps: 1-alpha = product of (1-opacity*kernel), summed in log space
+		log_t = self.log_t[np.round(opacity * 255).astype(np.int64)]
+		acc = np.bincount((py * T + px)[inside], weights=log_t[inside], minlength=T * T)
+		alpha = np.round((1 - np.exp(acc)) * 255).astype(np.uint8).reshape(T, T)
+		img = np.zeros((T, T, 4), dtype=np.uint8)
+		img[..., :3] = self.lut[alpha]
+		img[..., 3] = alpha
+		return img
+
+	def render(self, points, out_dir, zooms=range(10, 16)):
+		# INPUT: [latitude, longitude, weight] points, e.g. the weights normalized onto [min_weight, 1] by showHeatmaps()
+		# write the non-empty tiles as out_dir/<zoom>/<x>/<y>.png
+		# OUTPUT: the number of tiles written
+		T, n_written = self.tile_size, 0
+		for z in zooms:
+			x, y, opacity = self.cells(points, z)
+			# every cell lands on all tiles within r pixels of it
+			tx0, tx1 = np.floor((x - self.r) / T).astype(np.int64), np.floor((x + self.r) / T).astype(np.int64)
+			ty0, ty1 = np.floor((y - self.r) / T).astype(np.int64), np.floor((y + self.r) / T).astype(np.int64)
+			cell_ids, tiles = [], []
+			for dx in [0, 1]:
+				for dy in [0, 1]:
+					sel = np.flatnonzero((tx0 + dx <= tx1) & (ty0 + dy <= ty1))
+					cell_ids += [sel]
+					tiles += [(tx0[sel] + dx) * (1 << 32) + ty0[sel] + dy]
+			cell_ids, tiles = np.concatenate(cell_ids), np.concatenate(tiles)
+			order = np.argsort(tiles, kind='stable')
+			cell_ids, tiles = cell_ids[order], tiles[order]
+			uniq, starts = np.unique(tiles, return_index=True)
+			for tile, ids in zip(uniq, np.split(cell_ids, starts[1:])):
+				tx, ty = int(tile >> 32), int(tile & 0xffffffff)
+				img = self.render_tile(x[ids], y[ids], opacity[ids], tx, ty)
+				if not img[..., 3].any():
+					continue
+				fn = os.path.join(out_dir, str(z), str(tx), '%d.png' % ty)
+				os.makedirs(os.path.dirname(fn), exist_ok=True)
+				matplotlib.image.imsave(fn, img, format='png', pil_kwargs={'compress_level': 1})
+				n_written += 1
+		return n_written
+
+	def render_frames(self, data_list, out_dir, zooms=range(10, 16), index=None):
+		# render every time frame into out_dir/<frame>/<zoom>/<x>/<y>.png, frames are numbered from 1 as in HeatMapWithTime,
+		# and write out_dir/index.json with the frame labels
+		# OUTPUT: the number of tiles written
+		n_written = sum(self.render(frame, os.path.join(out_dir, str(t)), zooms) for t, frame in enumerate(data_list, 1))
+		with open(os.path.join(out_dir, 'index.json'), 'w') as fp:
+			json.dump({'index': list(index) if index is not None else [str(t) for t in range(1, len(data_list) + 1)],
+			           'zooms': list(zooms), 'url': '{t}/{z}/{x}/{y}.png'}, fp, indent=1)
+		return n_written
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] <input.csv',
+	                                 description='render the latitude, longitude (and optionally count) columns of a CSV into heatmap PNG tiles',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('out_dir', help='output directory of the <zoom>/<x>/<y>.png tiles')
+	parser.add_argument('--zooms', '-z', help='zoom levels to render', type=int, nargs='+', default=list(range(10, 16)))
+	parser.add_argument('--radius', '-r', help='point radius in pixels', type=int, default=11)
+	parser.add_argument('--blur', '-b', help='blur in pixels', type=int, default=8)
+	parser.add_argument('--min-weight', '-w', help='counts are normalized onto [min_weight, 1] as in showHeatmaps()', type=float, default=0.25)
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	import sys
+	import pandas as pd
+	df = pd.read_csv(sys.stdin)
+	cnt = df['count'].values.astype(float) if 'count' in df.columns else np.ones(len(df))
+	w = cnt * (1 - min_weight) / cnt.max() + min_weight if len(cnt) else cnt
+	n = HeatTileRenderer(radius, blur).render(np.column_stack([df['latitude'].values, df['longitude'].values, w]), out_dir, zooms)
+	print('%d tiles written to %s' % (n, out_dir), file=sys.stderr)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Region aggregation over user-supplied GeoJSON polygons (e.g. planning areas or custom zones), requires numpy only
+# A uniform grid over the region bounding boxes narrows every point down to the few regions whose bounding box
+# overlaps its grid cell, and the even-odd crossing test then runs for all candidate points of a region at once.
+
+import os, sys, gzip, json, argparse
+import numpy as np
+
+NAME_FIELDS = ['name', 'NAME', 'Name', 'PLN_AREA_N', 'SUBZONE_N', 'REGION_N']
+
+
+def load_geojson(fn_or_obj):
+	# INPUT: a GeoJSON file name (optionally .gz), a JSON string, or an already parsed FeatureCollection/Feature/geometry
+	if isinstance(fn_or_obj, dict):
+		return fn_or_obj
+	if fn_or_obj.lstrip().startswith('{'):
+		return json.loads(fn_or_obj)
+	with (gzip.open(fn_or_obj, 'rt') if fn_or_obj.endswith('.gz') else open(fn_or_obj)) as fp:
+		return json.load(fp)
+
+
+def _features(obj):
+	if obj.get('type') == 'FeatureCollection':
+		return obj['features']
+	if obj.get('type') == 'Feature':
+		return [obj]
+	return [{'type': 'Feature', 'properties': {}, 'geometry': obj}]
+
+
+def _polygons(geom):
+	# OUTPUT: the list of polygons of a geometry, each polygon is a list of rings (outer boundary first, then holes)
+	if geom is None:
+		return []
+	if geom['type'] == 'Polygon':
+		return [geom['coordinates']]
+	if geom['type'] == 'MultiPolygon':
+		return geom['coordinates']
+	if geom['type'] == 'GeometryCollection':
+		return [p for g in geom['geometries'] for p in _polygons(g)]
+	return []
+
+
+def _ring_edges(ring):
+	# OUTPUT: (m, 4) array of edges [x1, y1, x2, y2] in (longitude, latitude), the ring is closed if it is not already
+	xy = np.asarray(ring, dtype=float)[:, :2]
+	if len(xy) and (xy[0] != xy[-1]).any():
+		xy = np.vstack([xy, xy[:1]])
+	return np.hstack([xy[:-1], xy[1:]])
+
+
+def points_in_edges(x, y, edges, max_cells=1 << 21):
+	# even-odd rule: a point is inside if a ray towards +x crosses an odd number of edges; holes and multi-part
+	# polygons need no special handling as long as the rings of one region do not overlap each other
+	# points are processed in chunks so that the (points x edges) crossing matrix stays below max_cells
+	inside = np.zeros(len(x), dtype=bool)
+	if not len(edges) or not len(x):
+		return inside
+	x1, y1, x2, y2 = edges.T
+	dy = y2 - y1
+	slope = np.divide(x2 - x1, dy, out=np.zeros_like(dy), where=dy != 0)  # horizontal edges never cross
+	step = max(1, max_cells // len(edges))
+	for i in range(0, len(x), step):
+		px, py = x[i:i + step, None], y[i:i + step, None]
+		cross = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1) * slope)
+		inside[i:i + step] = np.count_nonzero(cross, axis=1) & 1
+	return inside
+
+
+class Regions:
+	def __init__(self, geojson, name_field=None, grid_size=128):
+		# geojson: see load_geojson(); only Polygon and MultiPolygon features are kept
+		# name_field: the feature property to use as region name, defaults to the first of NAME_FIELDS present
+		self.geojson = load_geojson(geojson)
+		self.features = [f for f in _features(self.geojson) if _polygons(f.get('geometry'))]
+		props = [f.get('properties') or {} for f in self.features]
+		if name_field is None:
+			name_field = next((k for k in NAME_FIELDS if any(k in p for p in props)), None)
+		self.name_field = name_field
+		self.names = [str(p.get(name_field, i)) for i, p in enumerate(props)]
+
+		self.edges = [np.vstack([_ring_edges(ring) for poly in _polygons(f['geometry']) for ring in poly if len(ring)])
+		              for f in self.features]
+		self.bbox = np.array([[e[:, [0, 2]].min(), e[:, [1, 3]].min(), e[:, [0, 2]].max(), e[:, [1, 3]].max()] for e in self.edges]).reshape(-1, 4)
+		self.build_grid(grid_size)
+
+	def __len__(self):
+		return len(self.features)
+
+	def build_grid(self, grid_size):
+		# every grid cell lists the regions whose bounding box overlaps it; a listed cell that none of the region's
+		# edges passes through lies entirely inside or entirely outside the region, so its points need no crossing test
+		self.grid_size = G = grid_size
+		self.grid_x0, self.grid_y0 = (self.bbox[:, 0].min(), self.bbox[:, 1].min()) if len(self) else (0, 0)
+		x1, y1 = (self.bbox[:, 2].max(), self.bbox[:, 3].max()) if len(self) else (1, 1)
+		self.cell_w, self.cell_h = max(x1 - self.grid_x0, 1e-9) / G, max(y1 - self.grid_y0, 1e-9) / G
+		# the +x ray of a point only crosses edges spanning its latitude, so a point is tested against the edges of its grid row
+		self.region_cells, self.region_cell_state, self.region_row_edges = [], [], []
+		for r in range(len(self)):
+			_, cx0, cy0 = self.cell_of(self.bbox[r, 0], self.bbox[r, 1])
+			_, cx1, cy1 = self.cell_of(self.bbox[r, 2], self.bbox[r, 3])
+			cy, cx = np.meshgrid(np.arange(cy0, cy1 + 1), np.arange(cx0, cx1 + 1), indexing='ij')
+			cells = (cy * G + cx).ravel()
+			edges = self.edges[r]
+			_, _, ey0 = self.cell_of(0, np.minimum(edges[:, 1], edges[:, 3]))
+			_, _, ey1 = self.cell_of(0, np.maximum(edges[:, 1], edges[:, 3]))
+			self.region_row_edges += [{row: edges[(ey0 <= row) & (ey1 >= row)] for row in range(cy0, cy1 + 1)}]
+			# state: 0 = outside, 1 = inside, 2 = on the boundary
+			state = np.where(np.isin(cells, self.edge_cells(edges)), 2, 0)
+			free = state == 0
+			centre_x, centre_y = self.grid_x0 + (cells[free] % G + 0.5) * self.cell_w, self.grid_y0 + (cells[free] // G + 0.5) * self.cell_h
+			state[free] = points_in_edges(centre_x, centre_y, self.edges[r])
+			self.region_cells += [cells[state > 0]]
+			self.region_cell_state += [state[state > 0]]
+
+	def edge_cells(self, edges):
+		# OUTPUT: the grid cells overlapped by the bounding box of any edge
+		_, cx0, cy0 = self.cell_of(np.minimum(edges[:, 0], edges[:, 2]), np.minimum(edges[:, 1], edges[:, 3]))
+		_, cx1, cy1 = self.cell_of(np.maximum(edges[:, 0], edges[:, 2]), np.maximum(edges[:, 1], edges[:, 3]))
+		w, h = cx1 - cx0 + 1, cy1 - cy0 + 1
+		n = w * h
+		e = np.repeat(np.arange(len(edges)), n)
+		k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+		return np.unique((cy0[e] + k // w[e]) * self.grid_size + cx0[e] + k % w[e])
+
+	def cell_of(self, x, y):
+		# OUTPUT: (whether the point is on the grid, cell column, cell row)
+		cx = np.floor((np.asarray(x, dtype=float) - self.grid_x0) / self.cell_w)
+		cy = np.floor((np.asarray(y, dtype=float) - self.grid_y0) / self.cell_h)
+		G = self.grid_size
+		on_grid = (cx >= 0) & (cx <= G) & (cy >= 0) & (cy <= G)  # cell G holds points on the far edge
+		return on_grid, np.clip(np.nan_to_num(cx), 0, G - 1).astype(np.int64), np.clip(np.nan_to_num(cy), 0, G - 1).astype(np.int64)
+
+	def assign(self, lat, lon):
+		# INPUT: arrays of latitude and longitude
+		# OUTPUT: the region number of every point, -1 if the point is in no region; the first region wins on overlaps
+		x, y = np.asarray(lon, dtype=float).ravel(), np.asarray(lat, dtype=float).ravel()
+		out = np.full(len(x), -1, dtype=np.int64)
+		on_grid, cx, cy = self.cell_of(x, y)
+		pts = np.flatnonzero(on_grid)
+		cell = cy[pts] * self.grid_size + cx[pts]
+		order = np.argsort(cell, kind='stable')
+		pts, cell = pts[order], cell[order]
+		starts = np.searchsorted(cell, np.arange(self.grid_size ** 2 + 1))
+
+		gather = lambda cells: np.concatenate([pts[starts[c]:starts[c + 1]] for c in cells]) if len(cells) else pts[:0]
+		for r, (cells, state) in enumerate(zip(self.region_cells, self.region_cell_state)):
+			inner = gather(cells[state == 1])
+			out[inner[out[inner] < 0]] = r
+			cand = gather(cells[state == 2])
+			x0, y0, x1, y1 = self.bbox[r]
+			cand = cand[(out[cand] < 0) & (x[cand] >= x0) & (x[cand] <= x1) & (y[cand] >= y0) & (y[cand] <= y1)]
+			cand = cand[np.argsort(cy[cand], kind='stable')]
+			rows, row_starts = np.unique(cy[cand], return_index=True)
+			for row, pp in zip(rows, np.split(cand, row_starts[1:])):
+				out[pp[points_in_edges(x[pp], y[pp], self.region_row_edges[r][row])]] = r
+		return out
+
+	def count(self, lat, lon, weights=None):
+		# OUTPUT: the (weighted) number of points in every region
+		idx = self.assign(lat, lon)
+		keep = idx >= 0
+		w = None if weights is None else np.asarray(weights, dtype=float).ravel()[keep]
+		return np.bincount(idx[keep], weights=w, minlength=len(self)).astype(float)
+
+	def to_geojson(self, **columns):
+		# OUTPUT: a FeatureCollection of the regions, with 'name' and every keyword argument (an array with one value
+		#         per region) added to the properties of each feature
+		features = []
+		for i, f in enumerate(self.features):
+			props = {**(f.get('properties') or {}), 'name': self.names[i],
+			         **{k: (v[i].item() if hasattr(v[i], 'item') else v[i]) for k, v in columns.items()}}
+			features += [{'type': 'Feature', 'properties': props, 'geometry': f['geometry']}]
+		return {'type': 'FeatureCollection', 'features': features}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] regions.geojson <input.csv 1>output.csv',
+	                                 description='count the rows of a CSV with latitude, longitude (and optionally count) columns per GeoJSON region',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('regions_file', help='GeoJSON file of the region polygons')
+	parser.add_argument('--name-field', '-n', help='feature property holding the region name', default=None)
+	parser.add_argument('--assign', '-a', help='output every input row with its region name attached, instead of the counts', action='store_true')
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	import pandas as pd
+	regions = Regions(regions_file, name_field)
+	df = pd.read_csv(sys.stdin)
+	if assign:
+		idx = regions.assign(df['latitude'].values, df['longitude'].values)
+		df['region'] = np.array(regions.names + [None], dtype=object)[idx]
+		df.to_csv(sys.stdout, index=False)
+	else:
+		cnt = regions.count(df['latitude'].values, df['longitude'].values, df['count'].values if 'count' in df.columns else None)
+		pd.DataFrame({'region': regions.names, 'count': cnt}).to_csv(sys.stdout, index=False)
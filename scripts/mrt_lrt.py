@@ -4,9 +4,15 @@
 
 import json
 import re
+from collections import defaultdict
 
 ALL_BUILDINGS = json.load(open('./buildings.json'))
 
+# OneMap entries hashed by building name, so that matching a station is one lookup instead of a scan of all buildings
+BUILDINGS_BY_NAME = defaultdict(list)
+for o in ALL_BUILDINGS:
+    BUILDINGS_BY_NAME[o['BUILDING']].append(o)
+
 MRT_STATION_CODE = re.compile('\\(([A-Z]{1,2}[0-9]{1,2}(?: / )?)+\\)')
 
 DATA_MALL_MRT_STATIONS = list(open('./MRT English & Chinese names.csv', 'r', encoding='utf-16'))[1:]
@@ -26,17 +32,8 @@ def is_mrt_station(stn):
 
     
 def add_onemap_data(stn, station_type='MRT'):
-    # Kids, this is inefficient -- you should use a hashtable, especially
-    # if you want to work for Google. On the other hand, our dataset is
-    # small-ish so it doesn't matter
-    
-    # print(stn['Station Name'].upper() + ' MRT STATION')
-    # print(list(filter(lambda x: (stn['Station Name'].upper() + ' MRT STATION') == x['BUILDING'], ALL_BUILDINGS)))
-    
-    matching_onemap_entries = [
-        o for o in ALL_BUILDINGS
-        if o['BUILDING'] == '{} {} STATION'.format(stn['Station Name'].upper(), station_type)
-    ]
+    matching_onemap_entries = list(BUILDINGS_BY_NAME.get(
+        '{} {} STATION'.format(stn['Station Name'].upper(), station_type), []))
     
     # Unfortunately, OneMap data no longer has the station line and
     # number, so we cannot positively identify which station belongs
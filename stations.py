@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Nearest MRT/LRT station lookup over mrt_stations.json and lrt_stations.json (see scripts/extract_*_stations.py)
+# Stations listed under several codes (interchanges, and MRT/LRT stations sharing a name) are merged into one station,
+# and every OneMap location (entrance building) of a station is a candidate point for the nearest-station search.
+
+import os, sys, json, argparse
+import numpy as np
+import pandas as pd
+
+STATION_FILES = {'MRT': 'mrt_stations.json', 'LRT': 'lrt_stations.json'}
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lat1, lon1, lat2, lon2):
+	# great-circle distance in metres, all arguments are broadcast numpy arrays in degrees
+	lat1, lon1, lat2, lon2 = [np.radians(np.asarray(v, dtype=float)) for v in [lat1, lon1, lat2, lon2]]
+	a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+	return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def load_stations(station_files=STATION_FILES, dirname=os.path.dirname(os.path.abspath(__file__))):
+	# OUTPUT: (stations, locations)
+	#   stations: pd.DataFrame(columns=['code', 'name', 'type', 'latitude', 'longitude']), one row per station,
+	#             code is e.g. 'EW24 / NS1', type is 'MRT', 'LRT' or 'MRT/LRT', latitude/longitude is the mean of its locations
+	#   locations: pd.DataFrame(columns=['station', 'latitude', 'longitude']), one row per distinct station location,
+	#              station is the row number in stations
+	rows = []
+	for stype, fn in station_files.items():
+		with open(os.path.join(dirname, fn)) as fp:
+			for stn in json.load(fp):
+				for loc in stn['Possible Locations'] or [{}]:
+					rows += [(stn['Station Name'].upper(), stn['Station'], stype, float(loc.get('LATITUDE', 'nan')), float(loc.get('LONGITUDE', 'nan')))]
+	df = pd.DataFrame(rows, columns=['name', 'code', 'type', 'latitude', 'longitude'])
+
+	# a station without any location (e.g. an LRT platform of an MRT interchange) still lends its code to the merged station
+	join = lambda ss: ' / '.join(sorted(set(ss)))
+	stations = df.groupby('name', sort=True).agg(code=('code', join), type=('type', lambda ss: '/'.join(sorted(set(ss), reverse=True))),
+	                                             latitude=('latitude', 'mean'), longitude=('longitude', 'mean'))
+	stations = stations.dropna().reset_index()[['code', 'name', 'type', 'latitude', 'longitude']]
+
+	locations = df.dropna().drop_duplicates(['name', 'latitude', 'longitude'])
+	locations = pd.DataFrame({'station': pd.Index(stations['name']).get_indexer(locations['name']),
+	                          'latitude': locations['latitude'].values, 'longitude': locations['longitude'].values})
+	return stations, locations
+
+
+class StationIndex:
+	def __init__(self, stations=None, locations=None):
+		if stations is None:
+			stations, locations = load_stations()
+		self.stations, self.locations = stations, locations
+		self.loc_station = locations['station'].values
+		self.loc_lat, self.loc_lon = locations['latitude'].values, locations['longitude'].values
+		# the candidate search runs on an equirectangular projection around the mean latitude, which over the extent
+		# of Singapore ranks distances the same as the great circle; the reported distance is the haversine one
+		self.cos_lat0 = np.cos(np.radians(self.loc_lat.mean()))
+		self.loc_xy = self.project(self.loc_lat, self.loc_lon)
+		self.loc_norm2 = (self.loc_xy ** 2).sum(axis=1)
+
+	def project(self, lat, lon):
+		return np.column_stack([np.asarray(lon, dtype=float) * self.cos_lat0, np.asarray(lat, dtype=float)])
+
+	def nearest(self, lat, lon, max_dist=None, chunk_size=4096):
+		# INPUT: arrays of latitude and longitude; points farther than max_dist metres from every station get no station
+		# OUTPUT: (station row numbers with -1 for NaN coordinates or no station, distances in metres with NaN for no station)
+		# the station table is small, so every chunk of points is matched against all locations at once with
+		# |p-s|^2 = |p|^2 - 2p.s + |s|^2, where p.s is a single matrix product
+		lat, lon = np.asarray(lat, dtype=float).ravel(), np.asarray(lon, dtype=float).ravel()
+		best = np.full(len(lat), -1, dtype=np.int64)
+		for i in range(0, len(lat), chunk_size):
+			xy = self.project(lat[i:i + chunk_size], lon[i:i + chunk_size])
+			d2 = xy @ self.loc_xy.T
+			d2 *= -2
+			d2 += self.loc_norm2
+			best[i:i + chunk_size] = d2.argmin(axis=1)
+
+		valid = ~(np.isnan(lat) | np.isnan(lon))
+		dist = np.full(len(lat), np.nan)
+		dist[valid] = haversine(lat[valid], lon[valid], self.loc_lat[best[valid]], self.loc_lon[best[valid]])
+		if max_dist is not None:
+			valid &= dist <= max_dist
+			dist[~valid] = np.nan
+		return np.where(valid, self.loc_station[best], -1), dist
+
+	def nearest_station(self, lat, lon, max_dist=None, chunk_size=4096):
+		# OUTPUT: pd.DataFrame(columns=['station_code', 'station_name', 'station_type', 'station_dist_m']), one row per point,
+		#         None/NaN where the point has no coordinates or is farther than max_dist metres from every station
+		idx, dist = self.nearest(lat, lon, max_dist, chunk_size)
+		table = self.stations[['code', 'name', 'type']].values
+		table = np.vstack([table, np.full((1, 3), None, dtype=object)])  # row -1 means no station
+		return pd.DataFrame({'station_code': table[idx, 0], 'station_name': table[idx, 1], 'station_type': table[idx, 2],
+		                     'station_dist_m': dist})
+
+
+_station_index = None
+
+
+def get_station_index():
+	global _station_index
+	if _station_index is None:
+		_station_index = StationIndex()
+	return _station_index
+
+
+def nearest_station(lat, lon, max_dist=None):
+	# vectorized nearest station for arrays of latitude and longitude, see StationIndex.nearest_station()
+	return get_station_index().nearest_station(lat, lon, max_dist)
+
+
+def add_nearest_station(df, max_dist=None):
+	# INPUT: pd.DataFrame with 'latitude' and 'longitude' columns, e.g., the output of draw_util.inferLatLon()
+	# OUTPUT: a copy of df with the columns station_code, station_name, station_type and station_dist_m attached
+	res = nearest_station(df['latitude'].values, df['longitude'].values, max_dist)
+	res.index = df.index
+	return pd.concat([df, res], axis=1)
+
+
+def count_by_station(df, max_dist=None):
+	# INPUT: pd.DataFrame(columns=['latitude', 'longitude', 'count'])
+	# OUTPUT: the total count of every catchment station, pd.DataFrame(columns=['code', 'name', 'type', 'latitude', 'longitude', 'count'])
+	#         with the station location as latitude/longitude, ready for draw_util.showCountmaps(); sorted by count descending
+	sidx = get_station_index()
+	idx, _ = sidx.nearest(df['latitude'].values, df['longitude'].values, max_dist)
+	keep = idx >= 0
+	counts = np.bincount(idx[keep], weights=df['count'].values[keep].astype(float), minlength=len(sidx.stations))
+	out = sidx.stations.assign(count=counts)
+	return out[out['count'] > 0].sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] <input.csv 1>output.csv',
+	                                 description='attach the nearest MRT/LRT station to every row of a CSV with latitude and longitude columns',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--max-dist', '-m', help='rows farther than this (in metres) from every station get no station', type=float, default=None)
+	parser.add_argument('--count', '-c', help='output the total count per station instead, using the count column', action='store_true')
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	df = pd.read_csv(sys.stdin)
+	out = count_by_station(df, max_dist) if count else add_nearest_station(df, max_dist)
+	out.to_csv(sys.stdout, index=False)
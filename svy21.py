@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# SVY21 <=> WGS84 conversion, vectorized over numpy arrays
+# SVY21 is the Transverse Mercator projection of WGS84 used by Singapore Land Authority, i.e., the X/Y columns of the
+# database; X is the easting and Y the northing, in metres. The series expansions follow the LINZ Transverse Mercator
+# formulae, as in https://github.com/cgcai/SVY21 .
+
+import sys, argparse
+import numpy as np
+
+# datum and projection constants
+A = 6378137.0
+F = 1 / 298.257223563
+ORIGIN_LAT, ORIGIN_LON = 1.366666, 103.833333
+ORIGIN_N, ORIGIN_E = 38744.572, 28001.642
+K = 1.0
+
+_b = A * (1 - F)
+_e2 = 2 * F - F * F
+_e4, _e6 = _e2 ** 2, _e2 ** 3
+_A0 = 1 - _e2 / 4 - 3 * _e4 / 64 - 5 * _e6 / 256
+_A2 = 3 / 8 * (_e2 + _e4 / 4 + 15 * _e6 / 128)
+_A4 = 15 / 256 * (_e4 + 3 * _e6 / 4)
+_A6 = 35 * _e6 / 3072
+_n = (A - _b) / (A + _b)
+_n2, _n3, _n4 = _n ** 2, _n ** 3, _n ** 4
+_G = A * (1 - _n) * (1 - _n2) * (1 + 9 * _n2 / 4 + 225 * _n4 / 64) * (np.pi / 180)
+
+
+def _meridian_dist(lat_r):
+	# meridian distance from the equator, latitude in radians
+	return A * (_A0 * lat_r - _A2 * np.sin(2 * lat_r) + _A4 * np.sin(4 * lat_r) - _A6 * np.sin(6 * lat_r))
+
+
+_M0 = _meridian_dist(np.radians(ORIGIN_LAT))
+
+
+def wgs84_to_svy21(lat, lon):
+	# INPUT: arrays (or scalars) of WGS84 latitude and longitude in degrees
+	# OUTPUT: (X, Y), i.e., SVY21 (easting, northing) in metres, with the shape of the input
+	lat_r = np.radians(np.asarray(lat, dtype=float))
+	w = np.radians(np.asarray(lon, dtype=float) - ORIGIN_LON)
+	sin_lat, cos_lat = np.sin(lat_r), np.cos(lat_r)
+	sin2 = sin_lat * sin_lat
+	v = A / np.sqrt(1 - _e2 * sin2)
+	rho = A * (1 - _e2) / (1 - _e2 * sin2) ** 1.5
+	psi = v / rho
+	psi2 = psi * psi
+	psi3, psi4 = psi2 * psi, psi2 * psi2
+	t2 = (sin_lat / cos_lat) ** 2
+	t4, t6 = t2 * t2, t2 * t2 * t2
+	w2 = w * w
+	w4, w6 = w2 * w2, w2 * w2 * w2
+	c2 = cos_lat * cos_lat
+	c3, c4 = c2 * cos_lat, c2 * c2
+	c5, c6, c7 = c4 * cos_lat, c4 * c2, c4 * c3
+
+	vs = v * sin_lat
+	n1 = w2 / 2 * vs * cos_lat
+	n2 = w4 / 24 * vs * c3 * (4 * psi2 + psi - t2)
+	n3 = w6 / 720 * vs * c5 * (8 * psi4 * (11 - 24 * t2) - 28 * psi3 * (1 - 6 * t2) + psi2 * (1 - 32 * t2) - psi * 2 * t2 + t4)
+	n4 = w6 * w2 / 40320 * vs * c7 * (1385 - 3111 * t2 + 543 * t4 - t6)
+	y = ORIGIN_N + K * (_meridian_dist(lat_r) - _M0 + n1 + n2 + n3 + n4)
+
+	e1 = w2 / 6 * c2 * (psi - t2)
+	e2 = w4 / 120 * c4 * (4 * psi3 * (1 - 6 * t2) + psi2 * (1 + 8 * t2) - psi * 2 * t2 + t4)
+	e3 = w6 / 5040 * c6 * (61 - 479 * t2 + 179 * t4 - t6)
+	x = ORIGIN_E + K * v * w * cos_lat * (1 + e1 + e2 + e3)
+	return x, y
+
+
+def svy21_to_wgs84(x, y):
+	# INPUT: arrays (or scalars) of SVY21 X (easting) and Y (northing) in metres
+	# OUTPUT: (latitude, longitude) in WGS84 degrees, with the shape of the input
+	x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+	# footpoint latitude: the latitude whose meridian distance is the northing
+	sigma = np.radians((_M0 + (y - ORIGIN_N) / K) / _G)
+	lat_p = (sigma + (3 * _n / 2 - 27 * _n3 / 32) * np.sin(2 * sigma) + (21 * _n2 / 16 - 55 * _n4 / 32) * np.sin(4 * sigma)
+	         + 151 * _n3 / 96 * np.sin(6 * sigma) + 1097 * _n4 / 512 * np.sin(8 * sigma))
+	sin_p, cos_p = np.sin(lat_p), np.cos(lat_p)
+	sin2 = sin_p * sin_p
+	v = A / np.sqrt(1 - _e2 * sin2)
+	rho = A * (1 - _e2) / (1 - _e2 * sin2) ** 1.5
+	psi = v / rho
+	psi2 = psi * psi
+	psi3, psi4 = psi2 * psi, psi2 * psi2
+	t = sin_p / cos_p
+	t2 = t * t
+	t4, t6 = t2 * t2, t2 * t2 * t2
+	e = x - ORIGIN_E
+	q = e / (K * v)
+	q2 = q * q
+	q3, q5 = q2 * q, q2 * q2 * q
+	q7 = q5 * q2
+
+	f = t / (K * rho)
+	l1 = f * e * q / 2
+	l2 = f * e * q3 / 24 * (-4 * psi2 + 9 * psi * (1 - t2) + 12 * t2)
+	l3 = f * e * q5 / 720 * (8 * psi4 * (11 - 24 * t2) - 12 * psi3 * (21 - 71 * t2) + 15 * psi2 * (15 - 98 * t2 + 15 * t4)
+	                         + 180 * psi * (5 * t2 - 3 * t4) + 360 * t4)
+	l4 = f * e * q7 / 40320 * (1385 - 3633 * t2 + 4095 * t4 + 1575 * t6)
+	lat = lat_p - l1 + l2 - l3 + l4
+
+	sec = 1 / cos_p
+	o1 = q * sec
+	o2 = q3 * sec / 6 * (psi + 2 * t2)
+	o3 = q5 * sec / 120 * (-4 * psi3 * (1 - 6 * t2) + psi2 * (9 - 68 * t2) + 72 * psi * t2 + 24 * t4)
+	o4 = q7 * sec / 5040 * (61 + 662 * t2 + 1320 * t4 + 720 * t6)
+	lon = np.radians(ORIGIN_LON) + o1 - o2 + o3 - o4
+	return np.degrees(lat), np.degrees(lon)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(usage='$0 [options] <input.csv 1>output.csv',
+	                                 description='convert the latitude/longitude columns of a CSV to SVY21 x/y columns, or the other way round',
+	                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--inverse', '-i', help='convert x/y (SVY21) to latitude/longitude (WGS84) instead', action='store_true')
+	opt = parser.parse_args()
+	globals().update(vars(opt))
+
+	import pandas as pd
+	df = pd.read_csv(sys.stdin)
+	if inverse:
+		df['latitude'], df['longitude'] = svy21_to_wgs84(df['x'].values, df['y'].values)
+	else:
+		df['x'], df['y'] = wgs84_to_svy21(df['latitude'].values, df['longitude'].values)
+	df.to_csv(sys.stdout, index=False)
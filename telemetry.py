@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Opt-in instrumentation of the hot paths: named counters and timing histograms
+# Disabled by default; hot paths check stats.enabled before doing any work, and stats.timer() returns a shared no-op
+# context manager when disabled. Enable with stats.enable() or by setting the environment variable ADDR_STATS=1.
+
+import os, sys, json, time, bisect
+from collections import defaultdict
+from contextlib import nullcontext
+
+_null_timer = nullcontext()
+
+
+class _Timer:
+	__slots__ = ('stats', 'name', 't0')
+
+	def __init__(self, stats, name):
+		self.stats, self.name = stats, name
+
+	def __enter__(self):
+		self.t0 = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.stats.add_time(self.name, time.perf_counter() - self.t0)
+		return False
+
+
+class Stats:
+	# upper bounds of the timing histogram buckets, in milliseconds
+	buckets_ms = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000, float('inf')]
+
+	def __init__(self, enabled=False):
+		self.enabled = enabled
+		self.reset()
+
+	def enable(self, enabled=True):
+		self.enabled = enabled
+		return self
+
+	def disable(self):
+		return self.enable(False)
+
+	def reset(self):
+		self.counters = defaultdict(int)
+		self.timings = {}  # name => [count, total_s, min_s, max_s, histogram]
+
+	def count(self, name, n=1):
+		if self.enabled:
+			self.counters[name] += n
+
+	def add_time(self, name, secs):
+		if not self.enabled:
+			return
+		t = self.timings.get(name)
+		if t is None:
+			t = self.timings[name] = [0, 0.0, secs, secs, [0] * len(self.buckets_ms)]
+		t[0] += 1
+		t[1] += secs
+		t[2] = min(t[2], secs)
+		t[3] = max(t[3], secs)
+		t[4][bisect.bisect_left(self.buckets_ms, secs * 1000)] += 1
+
+	def timer(self, name):
+		# usage: with stats.timer('heatmap.bin'): ...
+		return _Timer(self, name) if self.enabled else _null_timer
+
+	def snapshot(self):
+		# OUTPUT: the raw counters and timings, e.g. to pass from a worker process to merge() in the parent
+		return (dict(self.counters), self.timings) if self.enabled else None
+
+	def merge(self, snapshot):
+		# add the counters and timings of a snapshot() into this one
+		if not self.enabled or snapshot is None:
+			return
+		counters, timings = snapshot
+		for name, n in counters.items():
+			self.counters[name] += n
+		for name, (n, total, tmin, tmax, hist) in timings.items():
+			t = self.timings.get(name)
+			if t is None:
+				self.timings[name] = [n, total, tmin, tmax, list(hist)]
+				continue
+			t[0] += n
+			t[1] += total
+			t[2] = min(t[2], tmin)
+			t[3] = max(t[3], tmax)
+			t[4] = [a + b for a, b in zip(t[4], hist)]
+
+	def to_dict(self):
+		timings = {}
+		for name, (n, total, tmin, tmax, hist) in sorted(self.timings.items()):
+			timings[name] = {'count': n, 'total_ms': total * 1000, 'mean_ms': total * 1000 / n, 'min_ms': tmin * 1000,
+			                 'max_ms': tmax * 1000, 'histogram_ms': {'<=%g' % b: c for b, c in zip(self.buckets_ms, hist) if c}}
+		return {'counters': dict(sorted(self.counters.items())), 'timings': timings}
+
+	def dump(self, fn_or_fp=sys.stderr):
+		# write all counters and timings as JSON to a file name or a file object
+		txt = json.dumps(self.to_dict(), indent=1)
+		if type(fn_or_fp) == str:
+			with open(fn_or_fp, 'w') as fp:
+				fp.write(txt)
+		else:
+			print(txt, file=fn_or_fp)
+		return txt
+
+
+stats = Stats(enabled=os.environ.get('ADDR_STATS', '') not in ['', '0'])